@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+from collections import deque
+import logging
+import os
+import threading
+
+from metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeferredString:
+    """String computed only when it is converted with `str`, for instance when a log line is actually emitted."""
+
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return self.function(*self.args, **self.kwargs)
+
+
+class ActionSink:
+    """
+    Bounded queue of the actions writing to the disk or the logs ('save' and 'log'), executed by a background thread
+    so the inference does not wait for them. The thread executes the queued actions by batches of at most `batch_size`,
+    and creates the directories of a batch before executing it (the existing directories are cached, and created again
+    if an action fails because its directory was deleted meanwhile).
+
+    When the queue is full, `policy` can be :
+    - 'block' : wait for the queue to have some room ;
+    - 'drop_newest' : drop the new action ;
+    - 'drop_oldest' : drop the oldest queued action.
+
+    If `enabled` is False, the actions are executed right away by the calling thread.
+
+    The queued actions are executed before the program exits (`flush` is registered with `atexit`). Files saved from a filename
+    are copied by the background thread, so the file should not be deleted before `flush` is called.
+    """
+
+    POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+    def __init__(self, size=256, policy='block', batch_size=32):
+        self.enabled = False
+        self.size = size
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped = 0
+
+        self._queue = deque()
+        self._running = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._known_directories = set()
+
+    def configure(self, enabled, size=None, policy=None, batch_size=None):
+        if policy is not None and policy not in ActionSink.POLICIES:
+            raise ValueError("Unknown policy '{}', should be one of {}.".format(policy, ActionSink.POLICIES))
+
+        with self._condition:
+            self.enabled = enabled
+            self.size = size or self.size
+            self.policy = policy or self.policy
+            self.batch_size = batch_size or self.batch_size
+
+    def ensure_directory(self, directory):
+        """Create the directory if it does not exist yet (the directories already seen are not checked again)."""
+
+        if directory is None or directory in self._known_directories:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        self._known_directories.add(directory)
+
+    def _execute(self, function, args, directory):
+        """Execute `function(*args)`. If its directory was deleted since it was created, it is created again and the action retried once."""
+
+        try:
+            function(*args)
+        except FileNotFoundError:
+            if directory is None or directory not in self._known_directories:
+                raise
+            self._known_directories.discard(directory)
+            self.ensure_directory(directory)
+            function(*args)
+
+    def submit(self, function, *args, directory=None):
+        """Execute `function(*args)`, after creating the directory if it is not None, in the background thread if the sink is enabled."""
+
+        if not self.enabled:
+            self.ensure_directory(directory)
+            self._execute(function, args, directory)
+            return
+
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='action-sink', daemon=True)
+                self._thread.start()
+
+            while len(self._queue) >= self.size:
+                if self.policy == 'drop_newest':
+                    self._drop(function)
+                    return
+                elif self.policy == 'drop_oldest':
+                    self._drop(self._queue.popleft()[0])
+                else:
+                    self._condition.wait()
+
+            self._queue.append((function, args, directory))
+            self._condition.notify_all()
+
+    def _drop(self, function):
+        """Count the dropped action. Should be called with `self._condition` held."""
+
+        self.dropped += 1
+        metrics.increment('actions_dropped_total', function=getattr(function, '__name__', str(function)))
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning('Action sink full : %d actions dropped so far', self.dropped)
+
+    def _work(self):
+        """Execute the queued actions by batches."""
+
+        while True:
+            with self._condition:
+                while len(self._queue) == 0:
+                    self._condition.wait()
+
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._running = len(batch)
+                self._condition.notify_all()
+
+            for directory in {directory for _, _, directory in batch}:
+                try:
+                    self.ensure_directory(directory)
+                except OSError:
+                    logger.exception("Cannot create the directory '%s'", directory)
+
+            for function, args, directory in batch:
+                try:
+                    self._execute(function, args, directory)
+                except Exception:
+                    logger.exception('Error while executing a queued action')
+
+            with self._condition:
+                self._running = 0
+                self._condition.notify_all()
+
+    def flush(self):
+        """Wait until all the queued actions are executed."""
+
+        with self._condition:
+            while len(self._queue) > 0 or self._running > 0:
+                self._condition.wait()
+
+
+# Sink shared by all the processes
+action_sink = ActionSink()
+# The background thread is a daemon, so the queued actions would be lost at exit
+atexit.register(action_sink.flush)
@@ -1,15 +1,88 @@
 # -*- coding: utf-8 -*-
 
 from collections import Counter
+import operator
 import re
 
+import numpy as np
+
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '<=': operator.le,
+    '<': operator.lt
+}
+
+
+class ResultHistogram:
+    """
+    Histogram of the classes of a result (list of strings).
+
+    It is computed once per result and shared by all the triggers evaluated on it.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.total = len(result)
+        self._counter = Counter(result)
+        self._joined = None
+
+    def count(self, keyword):
+        """Return the number of occurences of the keyword in the result."""
+
+        return self._counter[keyword]
+
+    @property
+    def joined(self):
+        """Result concatenated with commas."""
+
+        if self._joined is None:
+            self._joined = ','.join(self.result)
+        return self._joined
+
+
+class BatchHistogram:
+    """
+    Histograms of the classes of several results at once, as NumPy arrays with one value per result.
+
+    It can be used in place of a `ResultHistogram` to evaluate triggers on a whole batch.
+    """
+
+    def __init__(self, results):
+        self.result = results
+        self.total = np.array([len(result) for result in results])
+        self._classes = np.array([cls for result in results for cls in result], dtype=object)
+        self._rows = np.repeat(np.arange(len(results)), self.total)
+        self._counts = {}
+        self._joined = None
+
+    def count(self, keyword):
+        """Return the number of occurences of the keyword in every result."""
+
+        if keyword not in self._counts:
+            self._counts[keyword] = np.bincount(self._rows[self._classes == keyword], minlength=len(self.total))
+        return self._counts[keyword]
+
+    @property
+    def joined(self):
+        """Results concatenated with commas."""
+
+        if self._joined is None:
+            self._joined = np.array([','.join(result) for result in self.result], dtype=object)
+        return self._joined
+
 
 class ActionTrigger:
     """
     Class representing the trigger for an action.
-    
+
     Its `is_valid` method should be called to check if the action should be executed.
     This method accept one argument : `result`, which is a list of strings.
+
+    The `evaluate` method does the same on a precomputed `ResultHistogram` (or on a `BatchHistogram`,
+    in which case it returns a boolean array).
     """
 
     # Regex to match something like 'false<=34.2%'
@@ -18,19 +91,30 @@ class ActionTrigger:
     ABSOLUTE_REGEX = r'^([\w ,:!§\/.?-]+)([<>=]=?)(\d+)$'
 
     def __init__(self, condition):
+        self.condition = condition
+        # Number of evaluations and of valid evaluations, for the ordering of the triggers of a collection
+        self.evaluations = 0
+        self.passes = 0
+
         if self._is_percentage(condition):
             self.keyword, self.operator, self.percentage_threshold = re.findall(ActionTrigger.PERCENTAGE_REGEX, condition)[0]
             self.percentage_threshold = float(self.percentage_threshold)
-            self.is_valid = self._percentage_match
+            self.evaluate = self._percentage_match
 
         elif self._is_absolute_number(condition):
             self.keyword, self.operator, self.count_threshold = re.findall(ActionTrigger.ABSOLUTE_REGEX, condition)[0]
             self.count_threshold = int(self.count_threshold)
-            self.is_valid = self._absolute_match
+            self.evaluate = self._absolute_match
 
         else:
             self.keyword = condition
-            self.is_valid = self._exact_match
+            self.operator = None
+            self.evaluate = self._exact_match
+
+        if self.operator is not None:
+            if self.operator not in OPERATORS:
+                raise ValueError("Unknown operator '{}' in condition '{}'.".format(self.operator, condition))
+            self._compare = OPERATORS[self.operator]
 
     def _is_percentage(self, condition):
         return re.match(ActionTrigger.PERCENTAGE_REGEX, condition)
@@ -38,41 +122,87 @@ class ActionTrigger:
     def _is_absolute_number(self, condition):
         return re.match(ActionTrigger.ABSOLUTE_REGEX, condition)
 
+    def is_valid(self, result):
+        return self.evaluate(ResultHistogram(result))
+
+    @property
+    def pass_rate(self):
+        """Fraction of the evaluations which were valid (1 if it was never evaluated)."""
+
+        return self.passes / self.evaluations if self.evaluations > 0 else 1.0
 
-    def _exact_match(self, result):
-        return ','.join(result) == self.keyword
-
-    def _compare(self, number_1, number_2):
-        if self.operator == '>':
-            return number_1 > number_2
-        elif self.operator == '>=':
-            return number_1 >= number_2
-        elif self.operator == '==':
-            return number_1 == number_2
-        elif self.operator == '<=':
-            return number_1 <= number_2
-        elif self.operator == '<':
-            return number_1 < number_2
-
-    def _percentage_match(self, result):
-        counter = Counter(result)
-        percentage = 100 * counter[self.keyword] / len(result)
+
+    def _exact_match(self, histogram):
+        return histogram.joined == self.keyword
+
+    def _percentage_match(self, histogram):
+        percentage = 100 * histogram.count(self.keyword) / np.maximum(histogram.total, 1)
         return self._compare(percentage, self.percentage_threshold)
-    
-    def _absolute_match(self, result):
-        counter = Counter(result)
-        count = counter[self.keyword]
-        return self._compare(count, self.count_threshold)
+
+    def _absolute_match(self, histogram):
+        return self._compare(histogram.count(self.keyword), self.count_threshold)
 
 
 class ActionTriggerCollection:
-    """Represent a collection of Action. The `is_valid` method will return True if all the action are valid."""
+    """
+    Represent a collection of Action. The `is_valid` method will return True if all the action are valid.
 
-    def __init__(self, conditions):
-        conditions = str(conditions).lower()
+    A precomputed `ResultHistogram` can be given to `is_valid` to share it with other collections,
+    and `is_valid_batch` evaluates the collection on several results at once.
 
-        conditions = conditions.split(';')
-        self.triggers = [ActionTrigger(condition) for condition in conditions]
-    
-    def is_valid(self, result):
-        return all(trigger.is_valid(result) for trigger in self.triggers)
+    The evaluation stops at the first invalid trigger. Every `REORDER_EVERY` evaluations, the triggers are sorted
+    by increasing pass rate, so the most selective ones are evaluated first.
+    """
+
+    REORDER_EVERY = 100
+
+    def __init__(self, conditions):
+        self.conditions = str(conditions).lower()
+        self.evaluations = 0
+        self.passes = 0
+
+        self.triggers = [ActionTrigger(condition) for condition in self.conditions.split(';')]
+
+    @property
+    def pass_rate(self):
+        """Fraction of the evaluations for which all the triggers were valid (1 if it was never evaluated)."""
+
+        return self.passes / self.evaluations if self.evaluations > 0 else 1.0
+
+    def _count_evaluations(self, count):
+        self.evaluations += count
+        if len(self.triggers) > 1 and self.evaluations % ActionTriggerCollection.REORDER_EVERY < count:
+            self.triggers = sorted(self.triggers, key=lambda trigger: trigger.pass_rate)
+
+    def is_valid(self, result, histogram=None):
+        if histogram is None:
+            histogram = ResultHistogram(result)
+
+        self._count_evaluations(1)
+        for trigger in self.triggers:
+            trigger.evaluations += 1
+            if not trigger.evaluate(histogram):
+                return False
+            trigger.passes += 1
+
+        self.passes += 1
+        return True
+
+    def is_valid_batch(self, results, histogram=None):
+        """Return a boolean array indicating, for every result, if all the triggers are valid."""
+
+        if histogram is None:
+            histogram = BatchHistogram(results)
+
+        self._count_evaluations(len(results))
+        valid = np.ones(len(results), dtype=bool)
+        for trigger in self.triggers:
+            evaluated = int(np.count_nonzero(valid))
+            if evaluated == 0:
+                break
+            valid &= trigger.evaluate(histogram)
+            trigger.evaluations += evaluated
+            trigger.passes += int(np.count_nonzero(valid))
+
+        self.passes += int(np.count_nonzero(valid))
+        return valid
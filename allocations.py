@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import threading
+
+
+class AllocationCounter:
+    """
+    Counter of the arrays allocated on the hot path of the pipe, by place of allocation.
+
+    It is only enabled in debug mode (`debug.count_allocations` in the config),
+    to catch the regressions of the zero-copy data path.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._counts = Counter()
+        self._bytes = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, name, array):
+        """Count the allocation of the array at the place `name`."""
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._counts[name] += 1
+            self._bytes[name] += array.nbytes
+
+    def snapshot(self):
+        """Return a dictionary {place: (number of allocations, number of bytes)}."""
+
+        with self._lock:
+            return {name: (count, self._bytes[name]) for name, count in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._bytes.clear()
+
+
+# Counter shared by all the processes
+allocations = AllocationCounter()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import math
+import mmap
+import struct
+import threading
+
+import numpy as np
+from scipy import signal
+
+from allocations import allocations
+from quantization import pcm_to_float
+
+
+# WAVE format tags
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WaveInfo:
+    """Format of the samples of a wave file, and position and size of its data chunk."""
+
+    __slots__ = ('channels', 'rate', 'sample_width', 'is_float', 'offset', 'size')
+
+    def __init__(self, channels, rate, sample_width, is_float, offset, size):
+        self.channels = channels
+        self.rate = rate
+        self.sample_width = sample_width
+        self.is_float = is_float
+        self.offset = offset
+        self.size = size
+
+
+def read_wave_info(fi):
+    """Read the header of the wave file opened in binary mode, up to the beginning of its data chunk."""
+
+    header = fi.read(12)
+    if len(header) < 12:
+        raise ValueError("'{}' is not a wave file.".format(fi.name))
+
+    riff, _, wave = struct.unpack('<4sI4s', header)
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError("'{}' is not a wave file.".format(fi.name))
+
+    fmt = None
+    while True:
+        header = fi.read(8)
+        if len(header) < 8:
+            raise ValueError("'{}' has no data chunk.".format(fi.name))
+
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            fmt = fi.read(chunk_size)
+            if chunk_size % 2 == 1:
+                fi.read(1)
+        elif chunk_id == b'data':
+            break
+        else:
+            # Chunks are padded to an even size
+            fi.seek(chunk_size + chunk_size % 2, 1)
+
+    if fmt is None:
+        raise ValueError("'{}' has no format chunk.".format(fi.name))
+
+    format_tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # The actual format is the first 2 bytes of the sub-format GUID
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise ValueError("'{}' : unsupported wave format {:#06x}.".format(fi.name, format_tag))
+
+    sample_width = (bits + 7) // 8
+    offset = fi.tell()
+    # The size of the data chunk can be wrong in files whose recording was interrupted
+    size = min(chunk_size, max(0, fi.seek(0, 2) - offset))
+    size -= size % (sample_width * channels)
+    return WaveInfo(channels, rate, sample_width, format_tag == WAVE_FORMAT_IEEE_FLOAT, offset, size)
+
+
+def read_wave(filepath, mmap_threshold=1 << 20):
+    """
+    Read the samples of the wave file, and return them as an array of shape (frames, channels) (see `decode_pcm`) with its sample rate.
+
+    The data of the files bigger than `mmap_threshold` bytes is memory-mapped instead of being read.
+    """
+
+    with open(filepath, 'rb') as fi:
+        info = read_wave_info(fi)
+        if info.size >= mmap_threshold:
+            # The mapping stays valid after the file is closed, as long as the array exists
+            data = memoryview(mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ))[info.offset:info.offset + info.size]
+        else:
+            fi.seek(info.offset)
+            data = fi.read(info.size)
+
+    return (decode_pcm(data, info.sample_width, info.channels, info.is_float), info.rate)
+
+
+def decode_pcm(data, sample_width, channels=1, is_float=False):
+    """
+    Return the interleaved little-endian PCM samples as an array of shape (frames, channels).
+
+    16 and 32-bit samples (and 32-bit floats) are views of the data. 8-bit samples (unsigned) are converted to int8,
+    and 24-bit samples to int32 shifted left by 8 bits, so the PCM integers are always normalized by their size (see `pcm_to_float`).
+    """
+
+    if is_float:
+        if sample_width != 4:
+            raise ValueError("Unsupported float samples of {} bytes.".format(sample_width))
+        audio = np.frombuffer(data, dtype='<f4')
+    elif sample_width in (2, 4):
+        audio = np.frombuffer(data, dtype='<i{}'.format(sample_width))
+    elif sample_width == 1:
+        audio = np.bitwise_xor(np.frombuffer(data, dtype=np.uint8), 0x80).view(np.int8)
+        allocations.count('decode_pcm', audio)
+    elif sample_width == 3:
+        triplets = np.frombuffer(data, dtype=np.uint8).reshape((-1, 3))
+        padded = np.zeros((len(triplets), 4), dtype=np.uint8)
+        padded[:, 1:] = triplets
+        audio = padded.view('<i4').reshape((-1))
+        allocations.count('decode_pcm', audio)
+    else:
+        raise ValueError("Unsupported sample width : {} bytes.".format(sample_width))
+
+    return audio.reshape((-1, channels))
+
+
+def encode_pcm(audio, sample_width):
+    """
+    Return the float audio (between -1 and 1) as little-endian PCM bytes of `sample_width` bytes per sample,
+    the inverse of `decode_pcm` : 8-bit samples are unsigned, and 24-bit samples are packed in 3 bytes.
+    """
+
+    if sample_width not in (1, 2, 3, 4):
+        raise ValueError("Unsupported sample width : {} bytes.".format(sample_width))
+
+    bits = 8 * sample_width
+    # 24-bit samples are computed as int32, then their 3 low bytes are kept
+    # (in float64, as float32 cannot represent the 32-bit maximum)
+    samples = np.rint(np.clip(audio, -1.0, 1.0, dtype=np.float64) * (2**(bits - 1) - 1))
+    samples = samples.astype('<i{}'.format(4 if sample_width == 3 else sample_width))
+    if sample_width == 1:
+        return np.bitwise_xor(samples.view(np.uint8), 0x80).tobytes()
+    if sample_width == 3:
+        return samples.view(np.uint8).reshape((-1, 4))[:, :3].tobytes()
+    return samples.tobytes()
+
+
+def mix_channels(audio, channel=None):
+    """
+    Return the audio of shape (frames, channels) as a 1D array : the channel `channel` (a strided view, without copy),
+    or the mean of the channels if `channel` is None (as float32, between -1 and 1 for PCM integers).
+    """
+
+    if audio.ndim == 1:
+        return audio
+
+    channels = audio.shape[1]
+    if channel is not None:
+        if not 0 <= channel < channels:
+            raise ValueError("Cannot select the channel {} of an audio with {} channels.".format(channel, channels))
+        return audio[:, channel]
+    if channels == 1:
+        return audio[:, 0]
+
+    scale = 1 / channels
+    if audio.dtype.kind == 'i':
+        scale /= 2**(8 * audio.dtype.itemsize - 1)
+
+    # Only one array is allocated for the sum and the normalization
+    mixed = np.sum(audio, axis=1, dtype=np.float32)
+    mixed *= scale
+    allocations.count('mix_channels', mixed)
+    return mixed
+
+
+class DecodedAudio:
+    """Audio already decoded as 1D float32 with its sample rate, used as the source of an audio whose original data is not kept (stream windows)."""
+
+    __slots__ = ('audio', 'rate')
+
+    def __init__(self, audio, rate):
+        self.audio = audio
+        self.rate = rate
+
+
+class Resampler:
+    """
+    Polyphase resampling (`scipy.signal.resample_poly`), whose anti-aliasing filter is designed once per ratio of rates
+    and shared by all the processes.
+    """
+
+    # Same filter as the default one of `resample_poly`
+    HALF_LENGTH = 10
+    WINDOW = ('kaiser', 5.0)
+
+    def __init__(self):
+        self._filters = {}
+        self._lock = threading.Lock()
+
+    def _filter(self, up, down):
+        key = (up, down)
+        with self._lock:
+            coefficients = self._filters.get(key)
+            if coefficients is None:
+                max_rate = max(up, down)
+                coefficients = signal.firwin(2 * Resampler.HALF_LENGTH * max_rate + 1, 1 / max_rate, window=Resampler.WINDOW)
+                coefficients = self._filters[key] = coefficients.astype(np.float32)
+            return coefficients
+
+    def resample(self, audio, rate, target_rate):
+        """Return the 1D audio resampled from `rate` to `target_rate` Hz, as float (unchanged if the rates are equal)."""
+
+        if rate == target_rate:
+            return audio
+
+        audio = pcm_to_float(audio)
+
+        divisor = math.gcd(int(rate), int(target_rate))
+        up, down = int(target_rate) // divisor, int(rate) // divisor
+        resampled = signal.resample_poly(audio, up, down, window=self._filter(up, down)).astype(np.float32, copy=False)
+        allocations.count('resample', resampled)
+        return resampled
+
+
+# Resampler shared by all the processes
+resampler = Resampler()
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the pipe, which runs without the real models nor EdgeTPU.
+
+The models are replaced by `StubInterpreter`, and synthetic audio clips and config are generated in a temporary directory
+(an existing config can also be used, its models are replaced the same way unless `--real` is given). The results are written as JSON.
+
+Exemples :
+    python benchmark.py --clips 200 --preprocess mfcc --output bench.json
+    python benchmark.py --config config.yml --real --threads 1
+    python benchmark.py --config config.yml --real --threads 4 --delegate xnnpack
+    python benchmark.py --zero-copy
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import wave
+
+import numpy as np
+import yaml
+
+from action_trigger import ActionTriggerCollection
+from config import Config
+from interpreter_pool import DELEGATES, registry
+from memory import governor
+import models
+from models import Processing
+from processes import Process
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+SAMPLE_RATE = 16000
+CLASS_COUNT = 521
+
+# Stage name -> (class, method) timed during the benchmark
+STAGES = {
+    'process': (Processing, 'process'),
+    'process_batch': (Processing, 'process_batch'),
+    'load_audio': (Processing, '_load_audio'),
+    'model_output': (Process, '_get_model_output'),
+    'invoke': (Process, '_invoke'),
+    'triggers': (ActionTriggerCollection, 'is_valid'),
+}
+
+
+class StubInterpreter:
+    """
+    Interpreter with the same interface as `tflite.Interpreter`, which does not need any model file.
+
+    The models whose path is in `StubInterpreter.classifiers` behave like a classifier (one row of `CLASS_COUNT` confidences
+    per second of audio, and a second output layer of embeddings), the others like an auto-encoder (output of the same shape as the input).
+    """
+
+    classifiers = set()
+
+    def __init__(self, model_path=None, **kwargs):
+        self.is_classifier = model_path in StubInterpreter.classifiers
+        self._input = None
+        self._shape = (1,)
+        self._outputs = {}
+
+        rng = np.random.default_rng(0)
+        self._weights = rng.standard_normal((500, CLASS_COUNT)).astype(np.float32)
+
+    def get_input_details(self):
+        return [{'index': 0, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        if self.is_classifier:
+            return [{'index': 1, 'dtype': np.float32, 'quantization': (0.0, 0)}, {'index': 2, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+        return [{'index': 1, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def get_tensor_details(self):
+        shapes = {0: self._shape}
+        if self.is_classifier:
+            rows = max(1, int(np.prod(self._shape)) // SAMPLE_RATE)
+            shapes.update({1: (rows, CLASS_COUNT), 2: (rows, 1024), 3: self._weights.shape})
+        else:
+            shapes[1] = self._shape
+        return [{'index': index, 'shape': np.array(shape), 'dtype': np.float32} for index, shape in shapes.items()]
+
+    def resize_tensor_input(self, index, shape, strict=False):
+        self._shape = tuple(shape)
+
+    def allocate_tensors(self):
+        self._input = np.zeros(self._shape, dtype=np.float32)
+
+    def set_tensor(self, index, value):
+        self._input = np.array(value, dtype=np.float32)
+
+    def invoke(self):
+        if not self.is_classifier:
+            self._outputs = {1: np.tanh(self._input)}
+            return
+
+        rows = max(1, self._input.size // SAMPLE_RATE)
+        frames = np.resize(self._input.reshape((-1)), rows * SAMPLE_RATE).reshape((rows, -1))[:, ::32]
+        logits = frames @ self._weights
+        confidences = np.exp(logits - logits.max(axis=1, keepdims=True))
+        self._outputs = {
+            1: confidences / confidences.sum(axis=1, keepdims=True),
+            2: np.repeat(frames[:, :256], 4, axis=1)
+        }
+
+    def get_tensor(self, index):
+        return self._outputs[index].copy()
+
+    def tensor(self, index):
+        return lambda: self._input if index == 0 else self._outputs[index]
+
+
+def generate_clips(directory, count, duration):
+    """Generate `count` WAV clips of `duration` seconds, half of them silent, and return their filenames."""
+
+    rng = np.random.default_rng(0)
+    filenames = []
+    for k in range(count):
+        amplitude = 0.0 if k % 2 == 0 else 0.9
+        audio = amplitude * rng.uniform(-1, 1, int(duration * SAMPLE_RATE))
+        filename = os.path.join(directory, 'clip{}.wav'.format(k))
+        with wave.open(filename, 'wb') as ww:
+            ww.setnchannels(1)
+            ww.setsampwidth(2)
+            ww.setframerate(SAMPLE_RATE)
+            ww.writeframes((audio * 32767).astype('<i2').tobytes())
+        filenames.append(filename)
+    return filenames
+
+
+def generate_config(directory, duration, preprocess=None):
+    """Generate a config similar to config.yml, with an anomaly process followed by a classification one, and return its path."""
+
+    labels = os.path.join(directory, 'labels.csv')
+    with open(labels, 'w', encoding='utf-8') as fo:
+        for k in range(CLASS_COUNT):
+            fo.write('{},class{}\n'.format(k, k))
+
+    seconds = int(duration)
+    config = {
+        'directories': {'temp_dir': os.path.join(directory, 'temp'), 'save_dir': os.path.join(directory, 'recordings')},
+        'udp': {'ip_address': '0.0.0.0', 'send_port': 7001, 'recv_port': 7000, 'id_length': 15, 'timeout': 15},
+        'audio': {'rate': SAMPLE_RATE, 'sample_width': 2, 'channels': 1, 'file_duration': duration},
+        'processes': [
+            {
+                'name': 'anomalies',
+                'position': 'input',
+                'type': 'anomaly',
+                'model': 'synthetic/anomaly.tflite',
+                'config': {'threshold': 0.04, 'input_shape': [seconds, SAMPLE_RATE, 1], 'preprocess': preprocess},
+                'actions': {
+                    'always': [{'action': 'output'}],
+                    'on_result': [{'true>0': {'action': 'next', 'input': 'same', 'target': 'classification'}}]
+                }
+            },
+            {
+                'name': 'classification',
+                'type': 'classification',
+                'model': 'synthetic/classification.tflite',
+                'config': {'labels': labels, 'minimum_confidence': 0.6, 'count': 3, 'input_shape': [seconds * SAMPLE_RATE], 'preprocess': None},
+                'actions': {
+                    'on_not_result': [{'silence>=100%': {'action': None}}],
+                    'always': [{'action': 'output'}, {'action': 'save', 'filename': '%d;%r;%a.wav', 'directory': 'default'}]
+                }
+            }
+        ]
+    }
+
+    path = os.path.join(directory, 'config.yml')
+    with open(path, 'w', encoding='utf-8') as fo:
+        yaml.safe_dump(config, fo)
+    return path
+
+
+def _timed(durations, method):
+    """Wrap the method to append its durations to the list."""
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            durations.append(time.perf_counter() - start)
+
+    return wrapper
+
+
+def _percentiles(durations):
+    """Return the count and the p50, p95 and p99 of the durations, in milliseconds."""
+
+    if len(durations) == 0:
+        return {'count': 0}
+
+    p50, p95, p99 = np.percentile(np.array(durations) * 1000, [50, 95, 99])
+    return {'count': len(durations), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+
+
+def _peak_rss():
+    """Return the peak resident memory of the process in bytes, or None if unknown."""
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In kilobytes on Linux, in bytes on macOS
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def run_benchmark(config_path, filenames, batch=False, warmup=5, real=False, num_threads=None, delegate=None, zero_copy=None):
+    """
+    Run the pipe on the files with stub interpreters (or the real ones if `real` is True) and return the measures as a dictionary.
+
+    `num_threads`, `delegate` and `zero_copy`, if not None, replace those of all the processes of the config.
+    """
+
+    config = Config(config_path)
+    for process in config.processes:
+        if num_threads is not None:
+            process['num_threads'] = num_threads
+        if delegate is not None:
+            process['delegate'] = delegate
+        if zero_copy is not None:
+            process['zero_copy'] = zero_copy
+    config.compile()
+
+    if not real:
+        StubInterpreter.classifiers = {process.model for process in config.pipeline.processes if process.type == 'classification'}
+        registry.interpreter_class = StubInterpreter
+
+    processing = Processing(config, 'benchmark')
+    for filename in filenames[:warmup]:
+        processing.process(filename)
+
+    durations = {stage: [] for stage in STAGES}
+    originals = {}
+    for stage, (cls, name) in STAGES.items():
+        originals[stage] = getattr(cls, name)
+        setattr(cls, name, _timed(durations[stage], originals[stage]))
+
+    try:
+        start = time.perf_counter()
+        if batch:
+            processing.process_batch(filenames)
+        else:
+            for filename in filenames:
+                processing.process(filename)
+        elapsed = time.perf_counter() - start
+    finally:
+        for stage, (cls, name) in STAGES.items():
+            setattr(cls, name, originals[stage])
+        processing.close()
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': os.path.abspath(config_path),
+        'clips': len(filenames),
+        'batch': batch,
+        'real': real,
+        'num_threads': num_threads,
+        'delegate': delegate,
+        'zero_copy': zero_copy,
+        'backends': {process.name: process.interpreters.backend for process in [processing.input_process] + processing.middle_processes.created() if process.interpreters is not None},
+        'elapsed_s': elapsed,
+        'clips_per_second': len(filenames) / elapsed,
+        'stages': {stage: _percentiles(stage_durations) for stage, stage_durations in durations.items()},
+        'peak_rss_bytes': _peak_rss(),
+        'memory_bytes': governor.usage()['bytes'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipe with stub models and synthetic clips.')
+    parser.add_argument('--config', default=None, help='config to benchmark (default : synthetic config similar to config.yml)')
+    parser.add_argument('--clips', type=int, default=100, help='number of clips')
+    parser.add_argument('--duration', type=float, default=5, help='duration of the clips, in seconds')
+    parser.add_argument('--preprocess', default=None, help='pre-processing of the input process of the synthetic config')
+    parser.add_argument('--batch', action='store_true', help='use Processing.process_batch')
+    parser.add_argument('--warmup', type=int, default=5, help='number of clips processed before measuring')
+    parser.add_argument('--output', default=None, help='JSON file where the results are written (default : standard output)')
+    parser.add_argument('--real', action='store_true', help='use the real models of the config (requires --config)')
+    parser.add_argument('--threads', type=int, default=None, help='number of threads of every interpreter')
+    parser.add_argument('--delegate', default=None, choices=DELEGATES, help='delegate of every interpreter')
+    parser.add_argument('--zero-copy', action='store_true', default=None, help='use the tensors of the interpreters without copying them')
+    args = parser.parse_args()
+
+    if args.real and args.config is None:
+        parser.error('--real requires --config')
+
+    models.logger.setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = generate_clips(directory, args.clips, args.duration)
+        config_path = args.config or generate_config(directory, args.duration, args.preprocess)
+        results = run_benchmark(config_path, filenames, args.batch, args.warmup, args.real, args.threads, args.delegate, args.zero_copy)
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as fo:
+            fo.write(output)
+
+
+if __name__ == '__main__':
+    main()
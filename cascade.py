@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class ProcessStats:
+    """Cost and pass rate of a process : number of runs, total duration and number of runs which triggered a 'next' action."""
+
+    __slots__ = ('runs', 'seconds', 'passes')
+
+    def __init__(self):
+        self.runs = 0
+        self.seconds = 0.0
+        self.passes = 0
+
+
+class CascadeStats:
+    """
+    Measured cost and pass rate of every process of the pipe, to find the stages of the cascade which are not worth their cost.
+
+    A process "passes" a clip when at least one of its 'next' actions is triggered. `report` suggests :
+    - to skip the processes which pass almost every clip (at least `skip_pass_rate` of them), as they do not filter anything ;
+    - to put a cheap `gate` process before the processes which reject almost every clip, if they are not already gates.
+    """
+
+    def __init__(self, skip_pass_rate=0.95, min_runs=100):
+        self.skip_pass_rate = skip_pass_rate
+        self.min_runs = min_runs
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, passed):
+        """Record a run of the process `name`, which lasted `seconds` and triggered a 'next' action if `passed`."""
+
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = ProcessStats()
+            stats.runs += 1
+            stats.seconds += seconds
+            stats.passes += bool(passed)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def report(self, processes):
+        """
+        Return, for every process (most expensive first), a dictionary with its number of runs, mean cost in milliseconds,
+        pass rate, the pass rate of its triggers and the suggestion about it (or None).
+        """
+
+        with self._lock:
+            stats = {name: (stats.runs, stats.seconds, stats.passes) for name, stats in self._stats.items()}
+
+        report = []
+        for process in processes:
+            runs, seconds, passes = stats.get(process.name, (0, 0.0, 0))
+            has_next = process.has_next_actions()
+            pass_rate = passes / runs if runs > 0 and has_next else None
+
+            suggestion = None
+            if pass_rate is not None and runs >= self.min_runs:
+                if pass_rate >= self.skip_pass_rate:
+                    suggestion = 'passes {:.0%} of the clips : it could be skipped and its targets run directly'.format(pass_rate)
+                elif pass_rate <= 1 - self.skip_pass_rate and process.type != 'gate':
+                    suggestion = 'rejects {:.0%} of the clips : a cheaper gate before it could avoid most of its runs'.format(1 - pass_rate)
+
+            report.append({
+                'process': process.name,
+                'runs': runs,
+                'mean_ms': 1000 * seconds / runs if runs > 0 else None,
+                'pass_rate': pass_rate,
+                'triggers': {
+                    trigger_collection.conditions: trigger_collection.pass_rate
+                    for trigger_collection, _ in process.on_result_actions + process.on_not_result_actions
+                },
+                'suggestion': suggestion,
+            })
+
+        return sorted(report, key=lambda line: line['mean_ms'] or 0.0, reverse=True)
+
+
+# Statistics shared by all the processes
+cascade = CascadeStats()
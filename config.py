@@ -20,11 +20,29 @@ class DotDict(dict):
     __delattr__ = dict.__delitem__
 
 class Config:
+    """
+    Config loaded from a YAML file, whose sections are read as DotDicts.
+
+    The pipe is compiled and checked when the config is loaded (see `pipeline.compile_pipeline`) : `pipeline` is the compiled pipe,
+    which should be compiled again with `compile` if the processes are modified afterwards.
+    """
+
     def __init__(self, config_path):
+        self.path = config_path
         self._config = DotDict(yaml.safe_load(open(config_path, 'r', encoding='utf-8')))
         self._processes_by_name = {}
         for process in self.processes:
             self._processes_by_name[process['name']] = DotDict(process)
+        self.compile()
+
+    def compile(self):
+        """Compile the pipe of the config in `self.pipeline` and return it."""
+
+        # Imported here, as the pipeline imports the processes, which import this module
+        from pipeline import compile_pipeline
+
+        self.pipeline = compile_pipeline(self)
+        return self.pipeline
 
     def __getattr__(self, attr):
         return self._config.__getattr__(attr)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import random
+import re
+import string
+import time
+
+import numpy as np
+
+
+# Characters kept in the filenames, the other ones are replaced by '_'
+VALID_FILENAME_CHARS = "-_.(),;!@=+{}{}".format(string.ascii_letters, string.digits)
+
+
+class _FilenameTable(dict):
+    """Translation table of `str.translate` replacing the invalid characters of a filename, filled as the characters are met."""
+
+    def __missing__(self, code):
+        value = self[code] = code if chr(code) in VALID_FILENAME_CHARS else '_'
+        return value
+
+FILENAME_TABLE = _FilenameTable()
+
+
+def sanitize_filename(filename):
+    """Replace the characters not in `VALID_FILENAME_CHARS` by '_'."""
+
+    return filename.translate(FILENAME_TABLE)
+
+
+class StringContext:
+    """
+    Values of one run of a process available to the placeholders of the CustomStrings.
+
+    The values derived from them (the classes as a string, the sequence number...) are computed on first use,
+    and shared by all the CustomStrings formatted with the same context.
+    """
+
+    __slots__ = ('process', 'client_id', 'results', 'model_outputs', 'timestamp', '_values')
+
+    def __init__(self, process, client_id, results=None, timestamp=None):
+        self.process = process
+        self.client_id = client_id
+        self.results = process.results if results is None else results
+        self.model_outputs = process.model_outputs
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self._values = {}
+
+    def get(self, name, compute):
+        """Return the value `name`, calling `compute(self)` the first time."""
+
+        value = self._values.get(name)
+        if value is None:
+            value = self._values[name] = compute(self)
+        return value
+
+
+_date_cache = (None, None)
+
+def _date(context, argument):
+    # Most of the strings of a second share the same date, so the last one is cached
+    global _date_cache
+    second = int(context.timestamp)
+    cached_second, date = _date_cache
+    if cached_second != second:
+        date = time.strftime('%Y_%m_%d-%H_%M_%S', time.localtime(second))
+        _date_cache = (second, date)
+    return date
+
+def _classes(context):
+    return str(context.results['classes']).lower()
+
+def _values(context):
+    return str(np.round(np.asarray(context.results['values'], dtype=np.float64), 2).tolist())
+
+def _layer(context, argument):
+    index = int(argument or 0)
+    output = context.model_outputs[context.process.output_layers[index]]
+    return str(np.round(np.asarray(output, dtype=np.float64).reshape((-1)), 2).tolist())[:50]
+
+def _sequence(context):
+    return str(next(context.process.sequence))
+
+
+# Code of the placeholder -> function(context, argument) returning its value as a string.
+# `argument` is the text between braces following the code (`%l{1}`), or None.
+PLACEHOLDERS = {
+    'n': lambda context, argument: context.process.name.lower(),
+    'r': lambda context, argument: context.get('classes', _classes)[:50],
+    'R': lambda context, argument: context.get('classes', _classes),
+    'd': _date,
+    'c': lambda context, argument: str(context.client_id),
+    'a': lambda context, argument: str(random.randint(1000, 9999)),
+    'v': lambda context, argument: context.get('values', _values)[:50],
+    'l': _layer,
+    's': lambda context, argument: context.get('sequence', _sequence),
+}
+
+
+class CustomString:
+    """
+    CustomString (see the README) parsed once, whose `format` method only evaluates the placeholders it contains.
+
+    To add a new placeholder, add its function to `PLACEHOLDERS`.
+
+    If `sanitize` is True, the characters which are not valid in a filename are replaced by '_'
+    (in the constant parts when the string is parsed, and in the values of the placeholders when it is formatted).
+    """
+
+    PLACEHOLDER_REGEX = re.compile(r'%([A-Za-z])(?:\{([^}]*)\})?')
+
+    def __init__(self, template, sanitize=False):
+        self.template = template
+        self.sanitize = sanitize
+
+        # Constant strings, and (function, argument) tuples for the placeholders
+        self._parts = []
+        position = 0
+        for match in CustomString.PLACEHOLDER_REGEX.finditer(template):
+            function = PLACEHOLDERS.get(match.group(1))
+            if function is None:
+                continue
+            self._add_constant(template[position:match.start()])
+            self._parts.append((function, match.group(2)))
+            position = match.end()
+        self._add_constant(template[position:])
+
+        self._constant = self._parts[0] if len(self._parts) == 1 and isinstance(self._parts[0], str) else None
+        if len(self._parts) == 0:
+            self._constant = ''
+
+    def _add_constant(self, constant):
+        if len(constant) == 0:
+            return
+        if self.sanitize:
+            constant = sanitize_filename(constant)
+        self._parts.append(constant)
+
+    def arguments(self, code):
+        """Return the arguments (None if there is not any) of the placeholders of the string with this code."""
+
+        function = PLACEHOLDERS[code]
+        return [part[1] for part in self._parts if not isinstance(part, str) and part[0] is function]
+
+    def format(self, context):
+        """Return the string with the values of the placeholders for this `StringContext`."""
+
+        if self._constant is not None:
+            return self._constant
+
+        values = []
+        for part in self._parts:
+            if isinstance(part, str):
+                values.append(part)
+            else:
+                value = part[0](context, part[1])
+                values.append(sanitize_filename(value) if self.sanitize else value)
+        return ''.join(values)
+
+    def __repr__(self):
+        return 'CustomString({!r})'.format(self.template)
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import logging
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+import tflite_runtime.interpreter as tflite
+
+from memory import governor
+from metrics import metrics
+from quantization import TensorQuantization
+
+
+logger = logging.getLogger(__name__)
+
+EDGE_TPU_LIB = {
+  'Linux': 'libedgetpu.so.1',
+  'Darwin': 'libedgetpu.1.dylib',
+  'Windows': 'edgetpu.dll'
+}[platform.system()]
+
+DELEGATES = ('edgetpu', 'xnnpack', 'none')
+
+# EdgeTPU delegate, loaded once and shared by all the interpreters (False if it is not available)
+_edgetpu_delegate = None
+_edgetpu_lock = threading.Lock()
+
+
+def _load_edgetpu_delegate():
+    """Return the EdgeTPU delegate, or None if it is not available."""
+
+    global _edgetpu_delegate
+    with _edgetpu_lock:
+        if _edgetpu_delegate is None:
+            try:
+                _edgetpu_delegate = tflite.load_delegate(EDGE_TPU_LIB)
+            except (ValueError, OSError):
+                logger.warning("EdgeTPU not found (%s)", EDGE_TPU_LIB)
+                _edgetpu_delegate = False
+        return _edgetpu_delegate or None
+
+
+def get_backend(delegate):
+    """
+    Return the backend actually used for the delegate, and the keyword arguments of the interpreter for it :
+    - 'edgetpu' : EdgeTPU delegate, or 'xnnpack' if it is not available ;
+    - 'xnnpack' : default delegates of tflite_runtime, which include XNNPACK on CPU ;
+    - 'none' : CPU kernels only, without any delegate.
+    """
+
+    if delegate not in DELEGATES:
+        raise ValueError("Unknown delegate '{}', should be one of {}.".format(delegate, DELEGATES))
+
+    if delegate == 'edgetpu':
+        edgetpu_delegate = _load_edgetpu_delegate()
+        if edgetpu_delegate is not None:
+            return ('edgetpu', {'experimental_delegates': [edgetpu_delegate]})
+        delegate = 'xnnpack'
+
+    if delegate == 'none':
+        return ('cpu', {'experimental_op_resolver_type': tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES})
+    return ('xnnpack', {})
+
+
+def estimate_interpreter_memory(interpreter):
+    """
+    Return an estimate of the memory, in bytes, of the interpreter once its tensors are allocated : the sum of the sizes of all its tensors
+    (weights and arena). Only the input and output tensors are counted if the interpreter does not give the details of the others.
+    """
+
+    if hasattr(interpreter, 'get_tensor_details'):
+        details = interpreter.get_tensor_details()
+    else:
+        details = interpreter.get_input_details() + interpreter.get_output_details()
+
+    return int(sum(np.prod(tensor['shape']) * np.dtype(tensor['dtype']).itemsize for tensor in details if 'shape' in tensor))
+
+
+class PooledInterpreter:
+    """
+    TFLite interpreter of a pool, which remembers the shape of its input tensor to only resize it when needed.
+
+    The type and quantization parameters of its input and output layers are given by `input_quantization` and `output_quantizations`,
+    and the shapes of its output layers (for the initial input shape) by `output_shapes`.
+
+    The interpreter runs with `num_threads` threads (default of tflite_runtime if None) and the delegate (see `get_backend`).
+    If the model cannot be loaded with the EdgeTPU delegate, it falls back to the CPU. The backend used is given by `backend`.
+
+    `memory` is an estimate of its memory for its current input shape (see `estimate_interpreter_memory`).
+    """
+
+    def __init__(self, interpreter_class, model_path, input_shape, num_threads=None, delegate='xnnpack'):
+        self.backend, options = get_backend(delegate)
+        try:
+            self.interpreter = interpreter_class(model_path=model_path, num_threads=num_threads, **options)
+        except (ValueError, RuntimeError):
+            if self.backend != 'edgetpu':
+                raise
+            logger.warning("Cannot load '%s' with the EdgeTPU delegate, falling back to the CPU", model_path, exc_info=True)
+            self.backend, options = get_backend('xnnpack')
+            self.interpreter = interpreter_class(model_path=model_path, num_threads=num_threads, **options)
+
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_layer = input_details['index']
+        self.input_quantization = TensorQuantization.from_details(input_details)
+        self.output_layers = []
+        self.output_quantizations = {}
+        for output_details in self.interpreter.get_output_details():
+            self.output_layers.append(output_details['index'])
+            self.output_quantizations[output_details['index']] = TensorQuantization.from_details(output_details)
+
+        self.input_shape = None
+        self.resize_input(input_shape, strict=True)
+        self.last_used = time.monotonic()
+
+        # Shapes of the output layers for this input shape (if the interpreter gives them)
+        self.output_shapes = {details['index']: tuple(details['shape']) for details in self.interpreter.get_output_details() if 'shape' in details}
+
+    def resize_input(self, shape, strict=False):
+        """Resize the input tensor and allocate the tensors, only if the shape changed since the last call."""
+
+        shape = list(shape)
+        if shape == self.input_shape:
+            return
+
+        # Invalidated first in case the resizing fails
+        self.input_shape = None
+        self.interpreter.resize_tensor_input(self.input_layer, shape, strict=strict)
+        self.interpreter.allocate_tensors()
+        self.input_shape = shape
+        self.memory = estimate_interpreter_memory(self.interpreter)
+
+
+class InterpreterPool:
+    """
+    Pool of interpreters of the same model, shared by all the processes using this model with the same input shape.
+
+    Interpreters are not thread-safe, so every thread running the model should use one checked out with `checkout`.
+    At most `size` interpreters are created, lazily, and only if the registry allows it. The threads wait when they are all in use.
+    """
+
+    def __init__(self, registry, model_path, input_shape, size=1, num_threads=None, delegate='xnnpack'):
+        self.registry = registry
+        self.model_path = model_path
+        self.input_shape = list(input_shape)
+        self.size = max(1, size)
+        self.num_threads = num_threads
+        self.delegate = delegate
+
+        self._idle = []
+        self._created = 0
+
+        # The first interpreter is created right away to check the model and get its layers
+        interpreter = self._get_interpreter()
+        self.input_layer = interpreter.input_layer
+        self.output_layers = interpreter.output_layers
+        self.input_quantization = interpreter.input_quantization
+        self.output_quantizations = interpreter.output_quantizations
+        self.output_shapes = interpreter.output_shapes
+        self.backend = interpreter.backend
+        # Estimate of the memory of each interpreter, for the input shape of the pool
+        self.interpreter_memory = interpreter.memory
+        self._put_interpreter(interpreter)
+
+    def _get_interpreter(self):
+        """Return an idle interpreter, create a new one if possible, else wait for one."""
+
+        with self.registry.condition:
+            while True:
+                if len(self._idle) > 0:
+                    return self._idle.pop()
+                if self._created < self.size and self.registry.reserve(self):
+                    self._created += 1
+                    break
+                self.registry.condition.wait()
+
+        try:
+            return PooledInterpreter(self.registry.interpreter_class, self.model_path, self.input_shape, self.num_threads, self.delegate)
+        except Exception:
+            with self.registry.condition:
+                self._created -= 1
+                self.registry.release()
+            raise
+
+    def _put_interpreter(self, interpreter):
+        """Make the interpreter available again."""
+
+        interpreter.last_used = time.monotonic()
+        with self.registry.condition:
+            self._idle.append(interpreter)
+            self.registry.condition.notify_all()
+
+    def _evict_idle(self):
+        """Drop one of the idle interpreters, if any, and return True if it was the case. Should be called with the registry condition held."""
+
+        if len(self._idle) == 0:
+            return False
+
+        # The least recently used interpreter is the first one
+        self._idle.pop(0)
+        self._created -= 1
+        return True
+
+    def _unload_idle(self, before):
+        """Drop the idle interpreters last used before `before` and return their number. Should be called with the registry condition held."""
+
+        count = 0
+        while len(self._idle) > 0 and self._idle[0].last_used < before:
+            self._idle.pop(0)
+            self._created -= 1
+            count += 1
+        return count
+
+    def acquire(self):
+        """Return an interpreter for the exclusive use of the current thread, until it is given back with `release`."""
+
+        return self._get_interpreter()
+
+    def release(self, interpreter):
+        self._put_interpreter(interpreter)
+
+    @contextlib.contextmanager
+    def checkout(self):
+        """Context manager giving an interpreter for the exclusive use of the current thread."""
+
+        interpreter = self.acquire()
+        try:
+            yield interpreter
+        finally:
+            self.release(interpreter)
+
+
+class ModelRegistry:
+    """
+    Registry of the interpreter pools of the whole Python process, keyed by model path, input shape, number of threads and delegate,
+    so that the models are only loaded once for all the `Processing` instances.
+
+    If `max_interpreters` is not None, it caps the number of live interpreters of all the pools : when it is reached,
+    an idle interpreter of another pool is dropped to create a new one, or the thread waits for one to become idle.
+
+    If `idle_timeout` is set (see `set_idle_timeout`), the interpreters unused for this number of seconds are unloaded,
+    and created again the next time their model is used.
+
+    `interpreter_class` is the class of the created interpreters, which can be replaced by any class
+    with the same interface as `tflite.Interpreter` (for instance to benchmark the pipe without the models).
+    """
+
+    def __init__(self, max_interpreters=None, interpreter_class=tflite.Interpreter):
+        self.max_interpreters = max_interpreters
+        self.interpreter_class = interpreter_class
+        self.condition = threading.Condition()
+        self._pools = {}
+        self._live = 0
+        self.idle_timeout = None
+        self._unloader = None
+
+    def get_pool(self, model_path, input_shape, size=1, num_threads=None, delegate=None):
+        """
+        Return the pool of the model for this input shape, which can be used by at least `size` threads at once.
+        See `PooledInterpreter` for `num_threads` and `delegate` (default : 'xnnpack').
+        """
+
+        delegate = delegate or 'xnnpack'
+        key = (os.path.abspath(model_path), tuple(input_shape), num_threads, delegate)
+        with self.condition:
+            pool = self._pools.get(key)
+            if pool is not None:
+                pool.size = max(pool.size, size)
+                return pool
+
+        # Created outside of the lock, because creating the first interpreter can wait for the registry
+        pool = InterpreterPool(self, model_path, input_shape, size, num_threads, delegate)
+        with self.condition:
+            if key in self._pools:
+                # Another thread created the same pool in the meantime, so the interpreters of this one are dropped
+                self._live -= pool._created
+                self.condition.notify_all()
+            return self._pools.setdefault(key, pool)
+
+    def reserve(self, pool):
+        """
+        Reserve a slot for a new interpreter of the pool, if possible, and return True if it was the case.
+        Should be called with `self.condition` held.
+        """
+
+        if self.max_interpreters is None or self._live < self.max_interpreters:
+            self._live += 1
+            return True
+
+        # The slot of an idle interpreter of another pool is reused
+        for other_pool in self._pools.values():
+            if other_pool is not pool and other_pool._evict_idle():
+                return True
+
+        return False
+
+    def release(self):
+        """Release the slot of an interpreter which was not created. Should be called with `self.condition` held."""
+
+        self._live -= 1
+        self.condition.notify_all()
+
+    def set_idle_timeout(self, idle_timeout):
+        """Unload the interpreters idle for more than `idle_timeout` seconds (never if None), with a background thread."""
+
+        with self.condition:
+            self.idle_timeout = idle_timeout
+            if idle_timeout is None or self._unloader is not None:
+                return
+            self._unloader = threading.Thread(target=self._unload_loop, name='interpreter-unloader', daemon=True)
+            self._unloader.start()
+
+    def _unload_loop(self):
+        while True:
+            with self.condition:
+                if self.idle_timeout is None:
+                    self._unloader = None
+                    return
+                idle_timeout = self.idle_timeout
+            time.sleep(max(0.1, idle_timeout / 2))
+            self.unload_idle()
+
+    def unload_idle(self, idle_timeout=None):
+        """Unload the interpreters idle for more than `idle_timeout` seconds (default : `self.idle_timeout`), and return their number."""
+
+        idle_timeout = self.idle_timeout if idle_timeout is None else idle_timeout
+        if idle_timeout is None:
+            return 0
+
+        before = time.monotonic() - idle_timeout
+        with self.condition:
+            # Several pools can share a model (with different shapes, threads or delegates)
+            unloaded = [(pool, pool._unload_idle(before)) for pool in self._pools.values()]
+            total = sum(count for _, count in unloaded)
+            if total > 0:
+                self._live -= total
+                self.condition.notify_all()
+
+        for pool, count in unloaded:
+            if count > 0:
+                logger.debug(
+                    "%d idle interpreter(s) of '%s' (input shape %s, threads %s, delegate %s) unloaded",
+                    count, pool.model_path, pool.input_shape, pool.num_threads, pool.delegate
+                )
+            for _ in range(count):
+                metrics.increment('interpreters_unloaded_total', model=os.path.basename(pool.model_path))
+        return total
+
+    def live_interpreters(self):
+        """Return the number of live interpreters."""
+
+        with self.condition:
+            return self._live
+
+    def memory(self):
+        """Return an estimate of the memory, in bytes, of the live interpreters (see `estimate_interpreter_memory`)."""
+
+        with self.condition:
+            return sum(pool._created * pool.interpreter_memory for pool in self._pools.values())
+
+
+# Registry shared by all the processes
+registry = ModelRegistry()
+
+# The idle interpreters are unloaded by `interpreters.idle_timeout`, not by the memory governor
+governor.add_source('interpreters', registry.memory)
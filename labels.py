@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the binary index written next to a labels file
+INDEX_SUFFIX = '.index.npz'
+
+
+class Labels:
+    """
+    Labels of a classification model : `labels` maps the index of a class to its name, and `label_names` and `has_label`
+    are read-only arrays indexed by the class index (name of the class or 'N/A', and whether it has a label), for vectorized lookups.
+    """
+
+    def __init__(self, indices, names):
+        self.labels = dict(zip(indices.tolist(), names.tolist()))
+
+        size = int(indices.max()) + 1 if len(indices) > 0 else 0
+        self.label_names = np.full(size, 'N/A', dtype=object)
+        self.label_names[indices] = names.tolist()
+        self.has_label = np.zeros(size, dtype=bool)
+        self.has_label[indices] = True
+
+        self.label_names.flags.writeable = False
+        self.has_label.flags.writeable = False
+
+
+def _parse(filepath):
+    """Parse the labels file, which should have one label per line, in the form '<index>,<label>'."""
+
+    indices, names = [], []
+    with open(filepath, 'r', encoding='utf-8') as fi:
+        for line in fi.read().splitlines():
+            if line == '':
+                continue
+            index, name = line.split(',')
+            indices.append(int(index))
+            names.append(name.lower())
+    return (np.array(indices, dtype=np.int64), np.array(names, dtype=str))
+
+
+def _read_index(filepath, stat):
+    """Return the indices and names of the binary index of the labels file, or None if it does not exist or is outdated."""
+
+    try:
+        with np.load(filepath + INDEX_SUFFIX, allow_pickle=False) as index:
+            if index['source'].tolist() != [stat.st_size, stat.st_mtime_ns]:
+                return None
+            return (index['indices'], index['names'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_index(filepath, stat, indices, names):
+    try:
+        with open(filepath + INDEX_SUFFIX, 'wb') as fo:
+            np.savez(fo, source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64), indices=indices, names=names)
+    except OSError:
+        # The directory of the labels may be read-only, the labels are then parsed at every start
+        logger.debug("Cannot write the index of the labels '%s'", filepath, exc_info=True)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_labels(filepath):
+    """
+    Return the `Labels` of the file, shared by all the processes using it.
+
+    The parsed labels are also saved in a binary index next to the file (`INDEX_SUFFIX`), read instead of the file
+    the next times the program starts, as long as the file is not modified.
+    """
+
+    if not os.path.isfile(filepath):
+        raise FileNotFoundError("Labels file '{}' not found.".format(filepath))
+
+    stat = os.stat(filepath)
+    key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        labels = _cache.get(key)
+        if labels is not None:
+            return labels
+
+        arrays = _read_index(filepath, stat)
+        if arrays is None:
+            arrays = _parse(filepath)
+            _write_index(filepath, stat, *arrays)
+
+        labels = _cache[key] = Labels(*arrays)
+        return labels
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+import logging
+import threading
+
+import numpy as np
+
+from metrics import metrics
+from quantization import ModelOutputs
+
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(value):
+    """Return an estimate of the number of bytes of the value : arrays, and dicts, lists and tuples of them (scalars count for 8 bytes)."""
+
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, ModelOutputs):
+        # The raw outputs of the quantized layers are distinct from their dequantized outputs
+        arrays = {id(array): array for array in list(value.values()) + list(value.raw.values())}
+        return sum(array.nbytes for array in arrays.values())
+    if isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return 8
+
+
+class ClipTicket:
+    """
+    Admission of a clip by the governor : its memory (`nbytes`) is accounted for from `MemoryGovernor.admit` until `release`.
+
+    `start` should be called when the processing of the clip begins. If the clip was dropped meanwhile, it returns False
+    and the clip should not be processed. `shed` is True if only the input process should be run on the clip.
+    """
+
+    __slots__ = ('governor', 'owner', 'nbytes', 'state', 'shed')
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DROPPED = 'dropped'
+    RELEASED = 'released'
+
+    def __init__(self, governor, owner, nbytes):
+        self.governor = governor
+        self.owner = owner
+        self.nbytes = nbytes
+        self.state = ClipTicket.QUEUED
+        self.shed = False
+
+    def start(self):
+        return self.governor._start(self)
+
+    def add(self, nbytes):
+        """Account for `nbytes` more bytes allocated for the clip (the decoded audio...)."""
+
+        self.governor._add(self, nbytes)
+
+    def release(self):
+        """Stop accounting for the clip. Can be called several times."""
+
+        self.governor._release(self)
+
+
+class MemoryGovernor:
+    """
+    Memory and concurrency governor shared by all the `Processing` instances (so by all the clients) of the Python process.
+
+    It accounts for the memory of the clips in flight (admitted with `admit` and not released yet, queued or running)
+    and of the sources registered with `add_source` : the live interpreters, the caches of features and results, the buffers of the server...
+
+    When the usage exceeds `budget` bytes, or when more than `max_clips` clips are in flight, the sources are first reclaimed
+    (the caches are cleared), then `policy` is applied :
+    - 'block' : the new clips wait to be admitted, and to start, until some clips in flight are finished
+      (the clips admitted with `wait=False` only wait to start) ;
+    - 'drop_oldest' : the oldest clips which are still queued are dropped when a new one is admitted ;
+    - 'shed' : the clips are processed by the input process only.
+    The running clips are never interrupted, so a clip is always started when there is no other running clip.
+
+    `usage` returns the current usage. Without `budget` nor `max_clips`, the clips are only accounted for.
+    """
+
+    POLICIES = ('block', 'drop_oldest', 'shed')
+
+    def __init__(self):
+        self.budget = None
+        self.max_clips = None
+        self.policy = 'block'
+
+        # Name -> (function returning its number of bytes, function freeing it or None)
+        self._sources = {}
+        # Clips in flight, in order of admission (dict used as an ordered set)
+        self._tickets = {}
+        self._bytes = 0
+        self._running = 0
+        self._running_bytes = 0
+        self._counts = Counter()
+        self._condition = threading.Condition()
+
+    def configure(self, budget=None, policy=None, max_clips=None):
+        if policy is not None and policy not in MemoryGovernor.POLICIES:
+            raise ValueError("Unknown memory policy '{}', should be one of {}.".format(policy, MemoryGovernor.POLICIES))
+
+        with self._condition:
+            self.budget = budget
+            self.max_clips = max_clips
+            self.policy = policy or self.policy
+            self._condition.notify_all()
+
+    def add_source(self, name, usage, reclaim=None):
+        """Account for the memory of the source, given by `usage()`. `reclaim()`, if given, frees it when the budget is exceeded."""
+
+        with self._condition:
+            self._sources[name] = (usage, reclaim)
+
+    def _sources_usage(self):
+        return {name: usage() for name, (usage, _) in list(self._sources.items())}
+
+    def _over(self, nbytes, clips):
+        """Return True if `nbytes` bytes of clips (with the sources) or `clips` clips exceed the limits. Should be called with `self._condition` held."""
+
+        if self.max_clips is not None and clips > self.max_clips:
+            return True
+        return self.budget is not None and sum(self._sources_usage().values()) + nbytes > self.budget
+
+    def _reclaim(self):
+        """Free the reclaimable sources. Should be called with `self._condition` held."""
+
+        for usage, reclaim in self._sources.values():
+            if reclaim is not None:
+                reclaim()
+        self._counts['reclaimed'] += 1
+
+    def _count(self, event, ticket):
+        """Count the event (dropped, shed or blocked clip). Should be called with `self._condition` held."""
+
+        self._counts[event] += 1
+        metrics.increment('clips_{}_total'.format(event), client=ticket.owner)
+        if self._counts[event] == 1 or self._counts[event] % 100 == 0:
+            logger.warning(
+                'Memory governor : %d clips %s so far (%d clips in flight, %d bytes of clips, budget %s)',
+                self._counts[event], event, len(self._tickets), self._bytes, self.budget
+            )
+
+    def admit(self, nbytes=0, owner=None, wait=True):
+        """
+        Admit a new clip of `nbytes` bytes, for the client `owner`, and return its `ClipTicket`.
+
+        With the 'block' policy, it waits until the clip fits in the limits, unless `wait` is False.
+        """
+
+        ticket = ClipTicket(self, owner, nbytes)
+        with self._condition:
+            if self._over(self._bytes + nbytes, len(self._tickets) + 1):
+                self._reclaim()
+
+                if self.policy == 'drop_oldest':
+                    for other in list(self._tickets):
+                        if not self._over(self._bytes + nbytes, len(self._tickets) + 1):
+                            break
+                        if other.state == ClipTicket.QUEUED:
+                            self._remove(other, ClipTicket.DROPPED)
+                            self._count('dropped', other)
+
+                elif self.policy == 'block' and wait and len(self._tickets) > 0 and self._over(self._bytes + nbytes, len(self._tickets) + 1):
+                    self._count('blocked', ticket)
+                    while len(self._tickets) > 0 and self._over(self._bytes + nbytes, len(self._tickets) + 1):
+                        # Timeout, because the sources do not notify when they shrink
+                        self._condition.wait(0.5)
+
+            self._tickets[ticket] = None
+            self._bytes += nbytes
+        return ticket
+
+    def _start(self, ticket):
+        with self._condition:
+            if ticket.state != ClipTicket.QUEUED:
+                return False
+
+            if self.policy == 'shed' and self._over(self._bytes, len(self._tickets)):
+                # The ticket is already in flight
+                ticket.shed = True
+                self._count('shed', ticket)
+            elif self.policy == 'block' and self._running > 0 and self._over(self._running_bytes + ticket.nbytes, self._running + 1):
+                self._count('blocked', ticket)
+                while self._running > 0 and self._over(self._running_bytes + ticket.nbytes, self._running + 1):
+                    self._condition.wait(0.5)
+
+            ticket.state = ClipTicket.RUNNING
+            self._running += 1
+            self._running_bytes += ticket.nbytes
+            return True
+
+    def _add(self, ticket, nbytes):
+        with self._condition:
+            if ticket.state not in (ClipTicket.QUEUED, ClipTicket.RUNNING):
+                return
+            ticket.nbytes += nbytes
+            self._bytes += nbytes
+            if ticket.state == ClipTicket.RUNNING:
+                self._running_bytes += nbytes
+
+    def _remove(self, ticket, state):
+        """Stop accounting for the ticket. Should be called with `self._condition` held."""
+
+        if ticket.state == ClipTicket.RUNNING:
+            self._running -= 1
+            self._running_bytes -= ticket.nbytes
+        del self._tickets[ticket]
+        self._bytes -= ticket.nbytes
+        ticket.state = state
+        self._condition.notify_all()
+
+    def _release(self, ticket):
+        with self._condition:
+            if ticket.state in (ClipTicket.QUEUED, ClipTicket.RUNNING):
+                self._remove(ticket, ClipTicket.RELEASED)
+
+    def usage(self):
+        """
+        Return the current usage as a dictionary :
+        - 'bytes' : number of bytes of every source and of the clips in flight ('clips'), and 'total' their sum ;
+        - 'clips' : number of clips in flight, 'queued' and 'running' ;
+        - 'clients' : number of bytes of the clips in flight of every client ;
+        - 'dropped', 'shed', 'blocked' : number of clips dropped, shed and blocked so far, and 'reclaimed' the number of reclaims of the sources ;
+        - 'budget', 'max_clips', 'policy' : the configuration.
+        """
+
+        with self._condition:
+            sizes = self._sources_usage()
+            sizes['clips'] = self._bytes
+            clients = Counter()
+            for ticket in self._tickets:
+                clients[ticket.owner] += ticket.nbytes
+
+            return {
+                'total': sum(sizes.values()),
+                'bytes': sizes,
+                'clips': {'queued': len(self._tickets) - self._running, 'running': self._running},
+                'clients': dict(clients),
+                'dropped': self._counts['dropped'],
+                'shed': self._counts['shed'],
+                'blocked': self._counts['blocked'],
+                'reclaimed': self._counts['reclaimed'],
+                'budget': self.budget,
+                'max_clips': self.max_clips,
+                'policy': self.policy,
+            }
+
+
+# Governor shared by all the processes
+governor = MemoryGovernor()
+
+metrics.add_gauge('memory_bytes', 'source', lambda: governor.usage()['bytes'])
+metrics.add_gauge('clips_in_flight', 'state', lambda: governor.usage()['clips'])
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+from collections import Counter
+import cProfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the buckets of the histograms
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Histogram of durations with the fixed buckets `BUCKETS`."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Instrumentation of the pipe : durations of every stage by process, counters by process and client, and gauges (see `add_gauge`).
+
+    Durations are measured by chaining `observe` calls, which return the time to use as start of the next stage :
+    >>> start = time.perf_counter()
+    >>> interpreter.invoke()
+    >>> start = metrics.observe('invoke', process_name, start)
+
+    Nothing is measured while `enabled` is False. The metrics can be exported in the Prometheus text format,
+    to a file (`write` or `start_file_exporter`) or to an HTTP socket (`start_http_exporter`).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_every = None
+        self.profile_dir = 'profiles'
+
+        self._histograms = {}
+        self._counters = Counter()
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._clips = itertools.count(1)
+        self._profiles = itertools.count(1)
+        self._file_exporter = None
+        self._http_exporter = None
+
+    def observe(self, stage, process, start):
+        """Record the duration of the stage of the process since `start` (from `time.perf_counter`), and return the current time."""
+
+        if not self.enabled:
+            return start
+
+        now = time.perf_counter()
+        key = (stage, process)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(now - start)
+        return now
+
+    def increment(self, name, **labels):
+        """Increment the counter `name` with these labels."""
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += 1
+
+    def add_gauge(self, name, label, function):
+        """Export the gauge `name`, whose values by value of the label `label` are given by `function()` as a dictionary, when the metrics are exported."""
+
+        with self._lock:
+            self._gauges[name] = (label, function)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+    def should_profile(self):
+        """Return True if the current clip should be profiled, which is the case of one clip every `profile_every`."""
+
+        return self.profile_every is not None and next(self._clips) % self.profile_every == 0
+
+    def profile(self, function, *args):
+        """Call the function with cProfile, and dump the statistics in `profile_dir`."""
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args)
+        finally:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            filepath = os.path.join(self.profile_dir, 'clip-{}-{}.prof'.format(time.strftime('%Y_%m_%d-%H_%M_%S'), next(self._profiles)))
+            profiler.dump_stats(filepath)
+            logger.info('Profile of the clip written in %s', filepath)
+
+
+    @staticmethod
+    def _format_labels(labels):
+        return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in labels)
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text format."""
+
+        with self._lock:
+            histograms = {key: (list(histogram.counts), histogram.sum, histogram.count) for key, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        lines = ['# TYPE pipeline_stage_seconds histogram']
+        for (stage, process), (counts, total, count) in sorted(histograms.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            labels = self._format_labels((('stage', stage), ('process', process or '')))
+            cumulated = 0
+            for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+                cumulated += bucket_count
+                lines.append('pipeline_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulated))
+            lines.append('pipeline_stage_seconds_sum{{{}}} {}'.format(labels, total))
+            lines.append('pipeline_stage_seconds_count{{{}}} {}'.format(labels, count))
+
+        names = sorted({name for name, _ in counters})
+        for name in names:
+            lines.append('# TYPE pipeline_{} counter'.format(name))
+            for (counter_name, labels), value in sorted(counters.items(), key=str):
+                if counter_name == name:
+                    lines.append('pipeline_{}{{{}}} {}'.format(name, self._format_labels(labels), value))
+
+        # Evaluated outside of the lock, as they can use other locks
+        for name, (label, function) in sorted(gauges.items()):
+            lines.append('# TYPE pipeline_{} gauge'.format(name))
+            for label_value, value in sorted(function().items(), key=str):
+                lines.append('pipeline_{}{{{}}} {}'.format(name, self._format_labels(((label, label_value),)), value))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filepath):
+        """Write the metrics in the file, atomically."""
+
+        # One temporary file per Python process, as the workers of a process pool can export to the same file
+        temp_filepath = '{}.{}.tmp'.format(filepath, os.getpid())
+        with open(temp_filepath, 'w', encoding='utf-8') as fo:
+            fo.write(self.to_prometheus())
+        os.replace(temp_filepath, filepath)
+
+    def start_file_exporter(self, filepath, interval=10):
+        """Write the metrics in the file every `interval` seconds, in a background thread. Only the first call has an effect."""
+
+        if self._file_exporter is not None:
+            return
+
+        def export():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write(filepath)
+                except OSError:
+                    logger.exception('Cannot write the metrics in %s', filepath)
+
+        self._file_exporter = threading.Thread(target=export, name='metrics-file', daemon=True)
+        self._file_exporter.start()
+
+    def start_http_exporter(self, port, address='0.0.0.0'):
+        """Serve the metrics over HTTP on this port, in a background thread. Only the first call has an effect."""
+
+        if self._http_exporter is not None:
+            return
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._http_exporter = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=self._http_exporter.serve_forever, name='metrics-http', daemon=True).start()
+
+
+# Metrics shared by all the processes
+metrics = Metrics()
@@ -1,190 +1,806 @@
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import logging
 import os
-import platform
 import shutil
-import string
+import threading
 import time
 import wave
 
 # import matplotlib.pyplot as plt
 import numpy as np
-import tflite_runtime.interpreter as tflite
 
+from action_sink import DeferredString, action_sink
+from action_trigger import ResultHistogram
+from allocations import allocations
+from audio_loader import DecodedAudio, decode_pcm, encode_pcm, mix_channels, read_wave, resampler
+from cascade import cascade
+from config import Config, DotDict
+from custom_string import CustomString, StringContext
+from interpreter_pool import registry
+from memory import governor
+from metrics import metrics
+from pipeline import check_pool
+from preprocessing import feature_cache
 from processes import Process
+from quantization import pcm_to_float
+from streaming import StreamBuffer
 
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(asctime)s\t%(levelname)s\t%(name)s  %(message)s")
 logger.setLevel(logging.DEBUG)
 
-EDGE_TPU_LIB = {
-  'Linux': 'libedgetpu.so.1',
-  'Darwin': 'libedgetpu.1.dylib',
-  'Windows': 'edgetpu.dll'
-}[platform.system()]
-logger.debug("Platform : %s - Edge TPU lib : %s", platform.system(), EDGE_TPU_LIB)
 
-VALID_FILENAME_CHARS = "-_.(),;!@=+{}{}".format(string.ascii_letters, string.digits)
+class LazyProcesses:
+    """
+    Middle processes of the pipe by name. If `lazy` is True, each process is only created (with `create(compiled process)`)
+    the first time it is accessed, else they are all created right away.
+
+    `values` creates all the processes, `created` only returns those which already exist.
+    """
+
+    def __init__(self, processes, create, lazy=False):
+        self._configs = {process.name: process for process in processes}
+        self._create = create
+        self._processes = {}
+        self._lock = threading.Lock()
+
+        if not lazy:
+            self.create_all()
+
+    def get(self, name, default=None):
+        process = self._processes.get(name)
+        if process is not None:
+            return process
+        if name not in self._configs:
+            return default
+
+        with self._lock:
+            process = self._processes.get(name)
+            if process is None:
+                start = time.perf_counter()
+                process = self._processes[name] = self._create(self._configs[name])
+                logger.debug("Process '%s' created in %.1f ms", name, 1000 * (time.perf_counter() - start))
+        return process
+
+    def __getitem__(self, name):
+        process = self.get(name)
+        if process is None:
+            raise KeyError(name)
+        return process
+
+    def __contains__(self, name):
+        return name in self._configs
+
+    def __iter__(self):
+        return iter(self._configs)
+
+    def __len__(self):
+        return len(self._configs)
+
+    def values(self):
+        return [self[name] for name in self._configs]
+
+    def create_all(self):
+        self.values()
+
+    def created(self):
+        """Return the processes already created, in the order of the config."""
+
+        return [self._processes[name] for name in self._configs if name in self._processes]
 
 
 class Processing:
-    """Class managing a full pipe of processes."""
+    """
+    Class managing a full pipe of processes.
 
-    def __init__(self, config, client_id):
-        try:
-            self.delegate = tflite.load_delegate(EDGE_TPU_LIB)
-        except:
-            logger.warning('EdgeTPU not found')
+    If the config has an `executor` section, audios can be submitted with `submit` to be processed concurrently :
+    - with a 'thread' executor, the sibling branches of the pipe are also run concurrently, and successive audios
+      are pipelined through the processes (each process running at most `workers` audios at the same time) ;
+    - with a 'process' executor, each audio is processed in a worker process owning its own `Processing`.
+
+    `parallel=False` ignores the executor of the config.
+
+    With `interpreters.lazy`, the processes other than the input one are only created when they are first needed
+    (see `LazyProcesses`), and with `interpreters.prewarm` they are created in the background after the start.
+
+    Every audio is admitted by the memory governor shared by all the instances (see `memory.MemoryGovernor`) before being processed :
+    depending on the `memory` section of the config, it can wait, be dropped (its returned data is then None) or be processed
+    by the input process only. The current usage is given by `memory_usage`.
+    """
 
+    def __init__(self, config, client_id, parallel=True):
         self.config = config
         self.client_id = client_id
-        self.parse_processes()
 
-    def parse_processes(self):
-        """Analyse all the DotDict containing processes and get them as Process class."""
+        # Compiled pipe, read instead of the DotDicts of the config while processing
+        self.pipeline = config.pipeline
+        self.audio = self.pipeline.audio
 
-        self.input_process = None
-        self.middle_processes = {}
-        for process in self.config.get_processes():
-            if process.position == 'input':
-                if self.input_process is not None:
-                    raise ValueError("Cannot create two input processes.")
+        self._configure_shared_objects()
+        self.parse_processes()
 
-                self.input_process = Process.create_process(process)
-            else:
-                self.middle_processes[process.name] = Process.create_process(process)
+        batch = self.config.batch or DotDict()
+        self.batch_size = batch.size or 1
+        self.batch_max_wait = batch.max_wait or 0
+        self._pending_sources = []
+        self._pending_since = None
+
+        result_cache = self.config.result_cache or DotDict()
+        self.skip_silence = bool(result_cache.skip_silence)
+        self.silence_threshold = result_cache.silence_threshold or 0.0
+        self._silent_returned_data = None
+
+        streaming = self.config.streaming or DotDict()
+        self.stream_hop = streaming.hop
+        self._stream = None
+        if self.stream_hop:
+            self._check_stream_hop()
+
+        self._create_executors(parallel)
+
+    def _create_executors(self, parallel: bool):
+        """Create the executors used to process the sibling branches of the pipe and the submitted audios."""
+
+        executor = self.config.executor or DotDict()
+        self.executor_type = executor.type if parallel else None
+        self._branch_executor = None
+        self._audio_executor = None
+
+        if self.executor_type is None:
+            return
+
+        workers = executor.workers or len(self.middle_processes) + 1
+        if self.executor_type == 'thread':
+            self._branch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='branch')
+            self._audio_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='audio')
+        elif self.executor_type == 'process':
+            self._audio_executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(self.config.path, self.client_id)
+            )
+        else:
+            raise ValueError("Unknown executor type : '{}'.".format(self.executor_type))
+
+    def _configure_shared_objects(self):
+        """
+        Configure the objects shared by all the `Processing` instances (interpreters, caches, metrics...).
+
+        They are only configured by the parts present in the config, so that a config without them does not reset them.
+        """
+
+        interpreters = self.config.interpreters
+        if interpreters is not None:
+            if interpreters.max_live is not None:
+                registry.max_interpreters = interpreters.max_live
+            if interpreters.idle_timeout is not None:
+                registry.set_idle_timeout(interpreters.idle_timeout)
+
+        cascade_config = self.config.cascade or DotDict()
+        if cascade_config.skip_pass_rate is not None:
+            cascade.skip_pass_rate = cascade_config.skip_pass_rate
+        if cascade_config.min_runs is not None:
+            cascade.min_runs = cascade_config.min_runs
+        self.report_every = cascade_config.report_every
+        self._clips = 0
+
+        actions = self.config.actions
+        if actions is not None:
+            action_sink.configure(bool(actions.asynchronous), actions.queue_size, actions.policy, actions.batch_size)
+
+        memory = self.config.memory
+        if memory is not None:
+            governor.configure(memory.budget, memory.policy, memory.max_clips)
+
+        debug = self.config.debug
+        if debug is not None:
+            allocations.enabled = bool(debug.count_allocations)
+
+        preprocessing = self.config.preprocessing or DotDict()
+        if preprocessing.cache_size is not None:
+            feature_cache.size = preprocessing.cache_size
+
+        metrics_config = self.config.metrics
+        if metrics_config is not None:
+            metrics.enabled = bool(metrics_config.enabled)
+            # 0 or less disables the profiling
+            metrics.profile_every = metrics_config.profile_every if (metrics_config.profile_every or 0) > 0 else None
+            if metrics_config.profile_dir is not None:
+                metrics.profile_dir = metrics_config.profile_dir
+            if metrics.enabled and metrics_config.file is not None:
+                metrics.start_file_exporter(metrics_config.file, metrics_config.interval or 10)
+            if metrics.enabled and metrics_config.port is not None:
+                metrics.start_http_exporter(metrics_config.port)
 
-        if self.input_process is None:
-            raise ValueError('No input process.')
+    def parse_processes(self):
+        """Create the processes of the compiled pipe of the config (see `pipeline.compile_pipeline`)."""
+
+        interpreters = self.config.interpreters or DotDict()
+
+        self.input_process = self._create_process(self.pipeline.input_process)
+        self.middle_processes = LazyProcesses(self.pipeline.middle_processes, self._create_process, lazy=bool(interpreters.lazy))
+        if interpreters.lazy and interpreters.prewarm:
+            threading.Thread(target=self.middle_processes.create_all, name='prewarm', daemon=True).start()
+
+        self.integer_audio = self.input_process.accepts_integer_audio
+        if self.integer_audio:
+            logger.debug("Input process '%s' takes integer audio", self.input_process.name)
+
+    @staticmethod
+    def _create_process(compiled):
+        """Create the Process of the compiled process, and check its output layers against its model (see `pipeline.check_pool`)."""
+
+        process = Process.create_process(compiled)
+        if process.interpreters is not None:
+            errors = check_pool(compiled, process.interpreters)
+            if len(errors) > 0:
+                raise ValueError(' '.join(errors))
+            logger.info(
+                "Process '%s' - backend : %s, threads : %s",
+                process.name, process.interpreters.backend, process.interpreters.num_threads or 'default'
+            )
+        return process
+
+
+    def _load_audio(self, source, integer=None, resample=True):
+        """
+        Return the audio as a np float32 array between -1 and 1, at the sample rate of the input process.
+
+        `source` can be the filename of a wave file (whose own format is used, and which is memory-mapped if it is bigger
+        than `audio.mmap_threshold` bytes), raw PCM bytes (bytes, bytearray or memoryview, in the format of the `audio` config)
+        or a NumPy array of shape (frames) or (frames, channels). Bytes are read without copy, and float arrays are considered already normalized.
+        The channel `audio.channel` is selected, or the channels are mixed if it is null (see `audio_loader.mix_channels`).
+        The returned array is read-only, as it is shared by all the processes of the pipe.
+
+        If `integer` is True (default : if the model of the input process takes quantized integers without pre-processing),
+        mono PCM integers are returned as is, without going through float : they are quantized for the model directly.
+
+        If `resample` is False, the audio is returned at its own sample rate (only for in-memory audio, which is at `audio.rate`).
+        """
+
+        start = time.perf_counter()
+        rate = self.audio.rate
+        if isinstance(source, str):
+            audio, rate = read_wave(source, self.audio.mmap_threshold)
+        elif isinstance(source, np.ndarray):
+            audio = source
+        else:
+            audio = decode_pcm(source, self.audio.sample_width, self.audio.channels)
 
+        if integer is None:
+            integer = self.integer_audio
 
-    def _load_audio(self, filename: str):
-        """Read audio wave file and return it as a np float32 array between 0 and 1."""
+        audio = mix_channels(audio, self.audio.channel)
+        if audio.dtype.kind == 'f':
+            audio = audio.astype(np.float32, copy=False)
+        elif not integer or (resample and rate != self.input_process.rate):
+            audio = pcm_to_float(audio)
 
-        with wave.open(filename, 'rb') as wr:
-            audio = wr.readframes(wr.getnframes())
+        if resample:
+            audio = resampler.resample(audio, rate, self.input_process.rate)
 
-        audio = np.frombuffer(audio, dtype=np.int16)
-        if len(audio.shape) > 1:
-            audio = np.mean(audio, axis=1)
+        if audio.flags.writeable:
+            audio = audio.view()
+            audio.flags.writeable = False
 
-        return audio.astype(np.float32) / (2**(8 * self.config.audio.sample_width - 1))
+        metrics.observe('load', None, start)
+        return audio
 
 
     def get_actions(self, process: Process, result: dict):
         """Generator of all the actions needed to be taken according to the result."""
 
-        yield from process.get_on_result_actions(result)
-        yield from process.get_on_not_result_actions(result)
+        # The histogram of the result is shared by all the triggers of the process
+        histogram = ResultHistogram(result)
+        yield from process.get_on_result_actions(result, histogram)
+        yield from process.get_on_not_result_actions(result, histogram)
         yield from process.get_always_actions()
 
+    def get_actions_batch(self, process: Process, results: list):
+        """Return the list of the actions of every result (list of classes), in the order of `get_actions`, with all the triggers evaluated at once."""
+
+        on_result, on_not_result = process.evaluate_triggers_batch(results)
+        always = list(process.get_always_actions())
+        return [
+            [action for (_, action), valid in zip(process.on_result_actions, on_result[k]) if valid]
+            + [action for (_, action), valid in zip(process.on_not_result_actions, on_not_result[k]) if valid]
+            + always
+            for k in range(len(results))
+        ]
+
 
     def get_next_process(self, current_process: Process, action, data, result: dict):
         """Return the next process in the pipeline and its input data."""
 
-        target_process = self.middle_processes.get(action.target, False)
-        if not target_process:
-            raise ValueError("Target process '{}' does not exist.".format(action.target))
+        # The target and the input were checked when the pipe was compiled
+        target_process = self.middle_processes[action.target.name]
 
         if action.input == 'same':
-            data = np.copy(data)
+            # Not copied, so the processes can share the features computed on it (unless it must be resampled)
+            data = resampler.resample(data, current_process.rate, target_process.rate)
         elif action.input == 'result':
-            data = np.copy(result)
-        elif str(action.input).isnumeric():
-            data = np.copy(current_process.get_result_of_layer(action.input))
+            data = np.asarray(result)
+            allocations.count('next_result', data)
         else:
-            raise ValueError("`input` field of the 'next' action should be 'same', 'result' or an int, not {}".format(action.input))
-        
+            # The outputs of the model are not used by anything else, so they are not copied either
+            data = current_process.get_result_of_layer(action.input)
+
         return (target_process, data)
 
 
-    def _get_filename(self, process: Process, action):
-        """Get the filename for the 'save' action."""
+    def _write_audio(self, filepath: str, source):
+        """Write the in-memory audio (PCM bytes, NumPy array or `DecodedAudio`, which is mono) as a wave file."""
 
-        filename = action.filename
-        if filename == "default":
-            filename = "%d-%n-%R.wav"
+        rate, channels = self.audio.rate, self.audio.channels
+        if isinstance(source, DecodedAudio):
+            rate, channels, source = source.rate, 1, source.audio
 
-        filename = process.replace_string(str(filename), self.client_id)
-        # Remove invalid characters from filename
-        filename = ''.join([c if c in VALID_FILENAME_CHARS else '_' for c in filename])
-        if not filename.endswith('.wav'):
-            filename += '.wav'
+        width = self.audio.sample_width
+        if isinstance(source, np.ndarray) and not (width in (2, 4) and source.dtype == np.dtype('<i{}'.format(width))):
+            # Float audio, and decoded 8 and 24-bit samples (int8 and shifted int32), are encoded as the samples of the file
+            source = encode_pcm(pcm_to_float(source), width)
 
-        return filename
-    
-    def _get_directory(self, process: Process, action):
-        """Get the directory for the 'save' action."""
+        with wave.open(filepath, 'wb') as ww:
+            ww.setnchannels(channels)
+            ww.setsampwidth(width)
+            ww.setframerate(rate)
+            ww.writeframes(source)
 
-        directory = action.directory
-        if directory is None or directory == "default":
-            directory = os.path.join(self.config.directories.save_dir, '%c')
+    @staticmethod
+    def _freeze_source(source):
+        """Return the in-memory audio, copied if its buffer can be modified before the action sink writes it (stream windows, user buffers)."""
 
-        directory = process.replace_string(str(directory), self.client_id)
+        if isinstance(source, (bytearray, memoryview)):
+            return bytes(source)
+        if isinstance(source, DecodedAudio):
+            return DecodedAudio(Processing._freeze_source(source.audio), source.rate)
+        if isinstance(source, np.ndarray) and not isinstance(source.base, bytes):
+            source = source.copy()
+            allocations.count('save_audio', source)
+        return source
 
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        return directory
+    def save_audio(self, action, source, context: StringContext):
+        """
+        Save the audio in the right path, and return it. `source` is either the filename of the audio or the in-memory audio.
 
-    def save_audio(self, process: Process, action, source_filename: str):
-        """Save the audio in the right path."""
+        The path is computed right away, but the file (and its directory) is written by the action sink.
+        """
 
-        filename = self._get_filename(process, action)
-        directory = self._get_directory(process, action)
-        filepath = os.path.join(directory, filename)
+        directory = action.directory_string.format(context)
+        filepath = os.path.join(directory, action.filename_string.format(context))
 
-        shutil.copy(source_filename, filepath)
+        if isinstance(source, str):
+            action_sink.submit(shutil.copy, source, filepath, directory=directory)
+        else:
+            if action_sink.enabled:
+                source = self._freeze_source(source)
+            action_sink.submit(self._write_audio, filepath, source, directory=directory)
         return filepath
 
 
-    def log_results(self, process: Process, line: str):
+    def log_results(self, line: CustomString, context: StringContext):
         """Log results according to the 'line'."""
 
-        if line == 'default':
-            line = "Process '%n' -> Result : '%r'"
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        # Only formatted when the line is emitted, with the values of the context of this run
+        action_sink.submit(logger.info, '%s', DeferredString(line.format, context))
+
+
+    def _run_actions(self, process: Process, results: dict, data, source, returned_data: dict, actions=None):
+        """
+        Execute all the actions of the process according to its results, and return the list of the next processes with their input data.
+        `actions` are the actions to execute if they were already selected (see `get_actions_batch`).
+        """
+
+        classes = results['classes']
+        next_processes = []
+        metrics.increment('process_runs_total', process=process.name, client=self.client_id)
+
+        start = time.perf_counter()
+        context = StringContext(process, self.client_id, results)
+        if process.log_string is not None:
+            self.log_results(process.log_string, context)
+            start = metrics.observe('log', process.name, start)
+
+        if actions is None:
+            actions = list(self.get_actions(process, classes))
+            start = metrics.observe('triggers', process.name, start)
+
+        for action in actions:
+            if action.action is None:
+                pass
+            elif action.action == 'next':
+                next_processes.append(self.get_next_process(process, action, data, classes))
+            elif action.action == 'save':
+                filepath = self.save_audio(action, source, context)
+                returned_data['filepath'] = filepath
+            elif action.action == 'log':
+                self.log_results(action.line_string, context)
+            elif action.action == 'output':
+                # A new results dict is created at every run of the process, so it does not need to be copied
+                returned_data[process.name] = results
+            else:
+                raise ValueError("Unknown action type '{}'.".format(action.action))
+
+            start = metrics.observe('action_{}'.format(action.action), process.name, start)
+            metrics.increment('actions_total', process=process.name, action=action.action)
+
+        return next_processes
+
+    def process(self, source, ticket=None):
+        """
+        Process the audio in the pipeline.
+
+        `source` can be the filename of a wave file, raw PCM bytes or a NumPy array (see `_load_audio`).
+        In-memory audio is only written to disk if a 'save' action is executed.
+
+        `ticket` is the `memory.ClipTicket` of the audio if it was already admitted by the memory governor, else it is admitted here.
+        Return None if the audio was dropped by the governor.
+        """
+
+        ticket = self._start_clip(ticket or governor.admit(self._source_nbytes(source), self.client_id))
+        if ticket is None:
+            return None
+
+        try:
+            start = time.perf_counter()
+            metrics.increment('clips_total', client=self.client_id)
+
+            audio = self._load_audio(source)
+            ticket.add(self._loaded_nbytes(audio, source))
+            if metrics.should_profile():
+                returned_data = metrics.profile(self._process_audio, audio, source, None, ticket.shed)
+            else:
+                returned_data = self._process_audio(audio, source, shed=ticket.shed)
+            metrics.observe('clip', None, start)
+        finally:
+            ticket.release()
+
+        if allocations.enabled:
+            logger.debug('Allocations : %s', allocations.snapshot())
+
+        self._clips += 1
+        if self.report_every and self._clips % self.report_every == 0:
+            self.log_cascade_report()
+        return returned_data
+
+    @staticmethod
+    def _start_clip(ticket):
+        """Return the ticket once its audio can be processed, or None if it was dropped."""
+
+        if ticket.start():
+            return ticket
+        ticket.release()
+        return None
+
+    @staticmethod
+    def _source_nbytes(source):
+        """Return the number of bytes of the in-memory audio (0 for a filename, whose audio is only counted once loaded)."""
+
+        if isinstance(source, DecodedAudio):
+            source = source.audio
+        if isinstance(source, np.ndarray):
+            return source.nbytes
+        if isinstance(source, memoryview):
+            return source.nbytes
+        return 0 if isinstance(source, str) else len(source)
+
+    @staticmethod
+    def _loaded_nbytes(audio, source):
+        """Return the number of bytes allocated to load the audio from the source (0 if it is a view of the in-memory audio)."""
+
+        if isinstance(source, str):
+            return audio.nbytes
+        buffer = source if isinstance(source, np.ndarray) else np.frombuffer(source, dtype=np.uint8)
+        return 0 if np.may_share_memory(audio, buffer) else audio.nbytes
+
+    def memory_usage(self):
+        """Return the memory usage of all the `Processing` instances (see `memory.MemoryGovernor.usage`)."""
+
+        return governor.usage()
+
+    def _is_silent(self, audio):
+        """Return True if no sample of the audio exceeds the silence threshold (without allocating the absolute values)."""
 
-        logger.info(
-            '%s',
-            process.replace_string(str(line), self.client_id)
-        )
+        threshold = self.silence_threshold
+        if audio.dtype.kind == 'i':
+            # The threshold is between 0 and 1, like the PCM integers normalized by their size
+            threshold *= 2**(8 * audio.dtype.itemsize - 1)
 
+        return audio.size > 0 and audio.max() <= threshold and audio.min() >= -threshold
 
-    def process(self, filename: str):
-        """Process the filename in the pipeline."""
+    def _process_audio(self, audio, source, stream_start=None, shed=False):
+        """
+        Process the loaded audio in the pipeline. `stream_start` is given to the input process if the audio is a window of a stream.
+        If `shed` is True, only the input process is run.
+
+        With `result_cache.skip_silence`, the pipeline is only run on the first silent audio : the following ones get
+        a copy of its returned data (without 'filepath'), and none of their actions is executed.
+        """
+
+        if self.skip_silence and self._is_silent(audio):
+            metrics.increment('silent_clips_total', client=self.client_id)
+            if self._silent_returned_data is not None:
+                return dict(self._silent_returned_data)
+
+            returned_data = self._run_pipeline(audio, source, stream_start, shed)
+            self._silent_returned_data = {key: value for key, value in returned_data.items() if key != 'filepath'}
+            return returned_data
+
+        return self._run_pipeline(audio, source, stream_start, shed)
+
+    def _run_pipeline(self, audio, source, stream_start=None, shed=False):
+        """Run all the processes of the pipeline on the audio (only the input process if `shed` is True)."""
 
-        audio = self._load_audio(filename)
-        processes = [(self.input_process, audio.copy())]
         returned_data = {}
+        processes = self._run_process(self.input_process, audio, source, returned_data, stream_start)
+        if shed:
+            return returned_data
+
+        if self._branch_executor is not None:
+            self._process_branches_concurrently(processes, source, returned_data)
+            return returned_data
 
         while len(processes) > 0:
             process, data = processes.pop(0)
+            processes.extend(self._run_process(process, data, source, returned_data))
+
+        return returned_data
+
+    def _run_process(self, process: Process, data, source, returned_data: dict, stream_start=None):
+        """Run the process on the data and its actions, and return the list of the next processes with their input data."""
+
+        try:
+            start = time.perf_counter()
+            results = process.process(data, stream_start)
+            cost = time.perf_counter() - start
+
+            next_processes = self._run_actions(process, results, data, source, returned_data)
+        finally:
+            process.end_run()
+        cascade.record(process.name, cost, len(next_processes) > 0)
+        return next_processes
+
+    def cascade_report(self):
+        """Return the cost and pass rate of every process of the pipe, with suggestions (see `cascade.CascadeStats.report`)."""
+
+        return cascade.report([self.input_process] + self.middle_processes.created())
+
+    def log_cascade_report(self):
+        for line in self.cascade_report():
+            logger.info(
+                "Cascade - process '%s' : %d runs, %s ms per run, pass rate %s%s",
+                line['process'],
+                line['runs'],
+                'N/A' if line['mean_ms'] is None else '{:.3f}'.format(line['mean_ms']),
+                'N/A' if line['pass_rate'] is None else '{:.1%}'.format(line['pass_rate']),
+                '' if line['suggestion'] is None else ' -> ' + line['suggestion']
+            )
+
+    def _check_stream_hop(self):
+        """Warn if `streaming.hop` does not let the pre-processing of the input process reuse the frames of the previous window."""
+
+        preprocessing = self.input_process.preprocessing
+        if not preprocessing.preprocessor.streamable:
+            return
+
+        rate, input_rate = self.audio.rate, self.input_process.rate
+        # Same hop as the stream buffer, at the rate of the input process
+        hop = int(round(self.stream_hop * rate)) * input_rate
+        if hop % rate != 0 or not preprocessing.reuses_stream_frames(hop // rate):
+            logger.warning(
+                "streaming.hop (%s s) is not a multiple of the %d samples between the frames of the pre-processing of '%s' at %d Hz : "
+                "their power spectrum cannot be reused between windows",
+                self.stream_hop, preprocessing.preprocessor.HOP_LENGTH, self.input_process.name, input_rate
+            )
+
+    def feed(self, samples):
+        """
+        Add samples (raw PCM bytes or NumPy array, see `_load_audio`) to the stream of the client, and process
+        every window of the stream completed by them. Return the list of the returned data of these windows.
+
+        A window has the length of the input of the input process (`audio.file_duration` seconds if it has no `input_shape`, as a gate),
+        and a new one starts every `streaming.hop` seconds, so the pre-processing of the input process can reuse the part overlapping the previous window.
+
+        The stream is buffered at `audio.rate`, and each window is resampled to the rate of the input process as a whole,
+        so the length of the fed chunks does not matter.
+        """
+
+        rate, input_rate = self.audio.rate, self.input_process.rate
+        if self.input_process.shape is not None:
+            size = int(np.prod(self.input_process.shape))
+        else:
+            size = int(round(self.audio.file_duration * input_rate))
+            if size <= 0:
+                raise ValueError("Cannot stream to the input process '{}' : it has no input_shape and `audio.file_duration` is not set.".format(self.input_process.name))
+        if self._stream is None:
+            # Enough samples at the rate of the stream for a whole window once resampled
+            stream_size = -(-size * rate // input_rate)
+            hop = int(round(self.stream_hop * rate)) if self.stream_hop else stream_size
+            self._stream = StreamBuffer(stream_size, hop)
+
+        returned_data = []
+        for window, start in self._stream.write(self._load_audio(samples, integer=False, resample=False)):
+            # The windows are views of the stream buffer, so only their resampled audio is accounted for
+            ticket = self._start_clip(governor.admit(0, self.client_id))
+            if ticket is None:
+                returned_data.append(None)
+                continue
+            try:
+                audio = window
+                if rate != input_rate:
+                    audio = resampler.resample(window, rate, input_rate)[:size]
+                    audio.flags.writeable = False
+                    ticket.add(audio.nbytes)
+                returned_data.append(self._process_audio(audio, DecodedAudio(window, rate), start * input_rate // rate, ticket.shed))
+            finally:
+                ticket.release()
+        return returned_data
 
-            results = process.process(np.copy(data))
-            classes = results['classes']
-
-            if process.log:
-                self.log_results(process, process.log)
-
-            for action in self.get_actions(process, classes):
-                if action.action is None:
-                    pass
-                elif action.action == 'next':
-                    processes.append(self.get_next_process(process, action, data, classes))
-                elif action.action == 'save':
-                    filepath = self.save_audio(process, action, filename)
-                    returned_data['filepath'] = filepath
-                elif action.action == 'log':
-                    self.log_results(process, action.line)
-                elif action.action == 'output':
-                    returned_data[process.name] = results.copy()
-                else:
-                    raise ValueError("Unknown action type '{}'.".format(action.action))
+    def _process_branches_concurrently(self, processes: list, source, returned_data: dict):
+        """Run the processes, and all the following ones, with the branch executor."""
+
+        futures = {self._branch_executor.submit(self._run_process, process, data, source, returned_data) for process, data in processes}
+
+        while len(futures) > 0:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                for process, data in future.result():
+                    futures.add(self._branch_executor.submit(self._run_process, process, data, source, returned_data))
+
+    def submit(self, source):
+        """
+        Submit the audio to be processed by the executor of the config and return a `concurrent.futures.Future` of its returned data.
+
+        Without executor, the audio is processed right away.
+        """
+
+        if self._audio_executor is None:
+            future = Future()
+            future.set_result(self.process(source))
+            return future
+
+        if self.executor_type == 'process':
+            # The worker processes have their own memory governor
+            return self._audio_executor.submit(_process_in_worker, source)
+        # Admitted right away, so the queued audios are accounted for (and can be dropped)
+        return self._audio_executor.submit(self.process, source, governor.admit(self._source_nbytes(source), self.client_id))
+
+    def close(self):
+        """Wait for the submitted audios and the queued actions, and stop the executors."""
+
+        for executor in (self._audio_executor, self._branch_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        action_sink.flush()
+
+    def process_batch(self, sources: list):
+        """
+        Process several audios (filenames or in-memory audios) in the pipeline and return the list of their returned data, in the same order.
+
+        The audios bound for the same process are grouped so that its model is invoked once per group
+        of at most `batch.size` audios, but the actions are still resolved for every audio.
+        """
+
+        returned_data = []
+        for start in range(0, len(sources), self.batch_size):
+            returned_data.extend(self._process_batch(sources[start:start + self.batch_size]))
 
         return returned_data
 
+    def _process_batch(self, sources: list):
+        """
+        Process one batch of audios in the pipeline.
+
+        The batch is admitted by the memory governor as a single clip (its audios are all held at the same time by this thread) :
+        if it is dropped, the returned data of all its audios is None, and if it is shed, they are all only run by the input process.
+        """
+
+        ticket = self._start_clip(governor.admit(sum(map(self._source_nbytes, sources)), self.client_id))
+        if ticket is None:
+            return [None] * len(sources)
+
+        returned_data = [{} for _ in sources]
+        try:
+            audios = [self._load_audio(source) for source in sources]
+            ticket.add(sum(self._loaded_nbytes(audio, source) for audio, source in zip(audios, sources)))
+            # Process name -> (process, [(index of the audio, data)]), to group the audios going to the same process
+            pending = {self.input_process.name: (self.input_process, list(enumerate(audios)))}
+
+            while len(pending) > 0:
+                process, items = pending.pop(next(iter(pending)))
+
+                # The outputs of a batch are copies (see `Process._invoke`), so they stay valid until the actions of every audio
+                runs = []
+                start = time.perf_counter()
+                for results in process.process_batch([data for _, data in items]):
+                    # The first element also bears the cost of the batched invoke
+                    runs.append((results, process.model_outputs, time.perf_counter() - start))
+                    start = time.perf_counter()
+
+                batch_actions = self.get_actions_batch(process, [results['classes'] for results, _, _ in runs])
+                metrics.observe('triggers', process.name, start)
+
+                for (k, data), (results, model_outputs, cost), actions in zip(items, runs, batch_actions):
+                    # The actions of every audio see the results and outputs of its own run
+                    process.results, process.model_outputs = results, model_outputs
+                    next_processes = self._run_actions(process, results, data, sources[k], returned_data[k], actions)
+                    cascade.record(process.name, cost, len(next_processes) > 0)
+
+                    if not ticket.shed:
+                        for next_process, next_data in next_processes:
+                            pending.setdefault(next_process.name, (next_process, []))[1].append((k, next_data))
+                process.end_run()
+        finally:
+            ticket.release()
+
+        return returned_data
+
+    def add_to_batch(self, source):
+        """
+        Add the audio (filename or in-memory audio) to the pending batch, which is processed once it has `batch.size` audios
+        or once its oldest audio has waited for more than `batch.max_wait` seconds.
+
+        There is no background thread : the waiting time is only checked by this method and by `poll_batch`,
+        which should be called by the caller when no audio comes (at the latest at `batch_deadline()`).
+
+        Return the list of (source, returned data) if the batch was processed, else None.
+        """
+
+        if len(self._pending_sources) == 0:
+            self._pending_since = time.monotonic()
+        self._pending_sources.append(source)
+
+        if len(self._pending_sources) >= self.batch_size:
+            return self.flush_batch()
+        return self.poll_batch()
+
+    def batch_deadline(self):
+        """Return the time (of `time.monotonic`) at which the pending batch should be processed, or None if there is no pending audio."""
+
+        if len(self._pending_sources) == 0:
+            return None
+        return self._pending_since + self.batch_max_wait
+
+    def poll_batch(self):
+        """Process the pending batch if its oldest audio has waited for `batch.max_wait` seconds, and return the list of (source, returned data), else None."""
+
+        deadline = self.batch_deadline()
+        if deadline is None or time.monotonic() < deadline:
+            return None
+        return self.flush_batch()
+
+    def flush_batch(self):
+        """Process all the pending audios and return the list of (source, returned data)."""
+
+        sources, self._pending_sources = self._pending_sources, []
+        return list(zip(sources, self.process_batch(sources)))
+
+
+# `Processing` of the current worker process, when using a 'process' executor
+_worker_processing = None
+
+
+def _init_worker(config_path: str, client_id):
+    """Initializer of the worker processes of a 'process' executor."""
+
+    global _worker_processing
+    _worker_processing = Processing(Config(config_path), client_id, parallel=False)
+
+
+def _process_in_worker(source):
+    """Process the audio in the `Processing` of the current worker process."""
+
+    return _worker_processing.process(source)
+
+
 if __name__ == '__main__':
     from config import Config
     processing = Processing(Config('config-pc.yml'), 'client')
-    print(processing.process("others/3sec2.wav"))
\ No newline at end of file
+    print(processing.process("others/3sec2.wav"))
+    processing.close()
\ No newline at end of file
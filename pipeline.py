@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compilation of the config into an immutable pipeline, checked once when the config is loaded.
+
+The processes and their actions become frozen dataclasses : the targets of the 'next' actions are references to the compiled
+target processes, and the CustomStrings are parsed, so nothing is looked up in the config while the audios are processed.
+The compilation checks the pipe (unknown targets or values, sizes of the chained inputs, cycles), and `check_models`
+also checks it against the models (indexes and sizes of their output layers), which can be done offline
+(the processes are also checked against their models when `Processing` creates them, see `check_pool`) :
+
+Exemple :
+    python pipeline.py config.yml
+"""
+
+import argparse
+from dataclasses import dataclass, field
+import math
+import os
+import sys
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
+
+from action_trigger import ActionTriggerCollection
+from custom_string import CustomString
+from interpreter_pool import DELEGATES, registry
+from preprocessing import PREPROCESSORS
+from processes import PROCESS_TYPES
+from result_cache import ResultCache
+
+
+DEFAULT_FILENAME = "%d-%n-%R.wav"
+DEFAULT_LINE = "Process '%n' -> Result : '%r'"
+
+ACTION_TYPES = (None, 'next', 'save', 'log', 'output')
+INPUT_TYPES = ('same', 'result')
+
+
+@dataclass(frozen=True, slots=True)
+class AudioSpec:
+    rate: int
+    sample_width: int
+    channels: int
+    file_duration: float
+    channel: Optional[int] = None
+    mmap_threshold: int = 1 << 20
+
+
+@dataclass(frozen=True, slots=True)
+class CacheSpec:
+    size: int = 64
+    ttl: float = 60
+    fingerprint: str = 'hash'
+    resolution: Optional[float] = None
+
+
+@dataclass(frozen=True, slots=True)
+class ModelConfig:
+    """`config` of a process. The keys which are not fields (used by custom processes) are in `extra`, and can also be read as attributes."""
+
+    input_shape: Optional[Tuple[int, ...]] = None
+    preprocess: Optional[str] = None
+    threshold: Optional[float] = None
+    labels: Optional[str] = None
+    minimum_confidence: Optional[float] = None
+    count: Optional[int] = None
+    extra: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.extra.get(name)
+
+
+@dataclass(frozen=True, slots=True)
+class ActionSpec:
+    """
+    Action of a process. For a 'next' action, `target` is the compiled target process and `input` is 'same', 'result'
+    or the position of an output layer (int).
+    """
+
+    action: Optional[str]
+    target: Optional['ProcessSpec'] = field(default=None, repr=False, compare=False)
+    input: Any = None
+    filename_string: Optional[CustomString] = None
+    directory_string: Optional[CustomString] = None
+    line_string: Optional[CustomString] = None
+
+
+@dataclass(frozen=True, slots=True)
+class ActionsSpec:
+    """Actions of a process : (condition, ActionSpec) tuples for `on_result` and `on_not_result`, and ActionSpecs for `always`."""
+
+    on_result: Tuple[Tuple[str, ActionSpec], ...] = ()
+    on_not_result: Tuple[Tuple[str, ActionSpec], ...] = ()
+    always: Tuple[ActionSpec, ...] = ()
+
+    def all(self):
+        return [action for _, action in self.on_result + self.on_not_result] + list(self.always)
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class ProcessSpec:
+    """
+    Compiled process. `kept_layers` are the positions of the output layers still needed after a run
+    (input of the 'next' actions, `%l` placeholders of the strings).
+    """
+
+    name: str
+    type: str
+    model: Optional[str]
+    position: Optional[str]
+    workers: int
+    num_threads: Optional[int]
+    delegate: str
+    zero_copy: bool
+    rate: int
+    cache: Optional[CacheSpec]
+    config: ModelConfig
+    log: Any
+    log_string: Optional[CustomString]
+    actions: ActionsSpec = field(default_factory=ActionsSpec, repr=False)
+    kept_layers: frozenset = frozenset()
+
+
+@dataclass(frozen=True, slots=True)
+class Pipeline:
+    audio: AudioSpec
+    input_process: ProcessSpec
+    processes: Tuple[ProcessSpec, ...]
+
+    @property
+    def middle_processes(self):
+        return [process for process in self.processes if process is not self.input_process]
+
+
+class _Compiler:
+    """Compile the config, collecting all the errors found so they can be reported at once."""
+
+    def __init__(self, config):
+        self.config = config
+        self.errors = []
+
+    def error(self, message, *args):
+        self.errors.append(message.format(*args))
+
+    def compile(self):
+        audio = self._audio(self.config.audio)
+
+        processes = {}
+        raw_processes = {}
+        for process in self.config.processes or []:
+            name = process.get('name')
+            if name is None:
+                self.error("A process has no name.")
+            elif name in processes:
+                self.error("Two processes are named '{}'.", name)
+            else:
+                processes[name] = self._process(process, audio)
+                raw_processes[name] = process
+
+        inputs = [process for process in processes.values() if process.position == 'input']
+        if len(inputs) != 1:
+            self.error("There should be exactly one input process, not {}.", len(inputs))
+
+        # The actions can only be compiled once all the processes exist, to reference them
+        for process in processes.values():
+            self._actions(process, raw_processes[process.name].get('actions') or {}, processes)
+
+        if len(self.errors) == 0:
+            self._check_cycles(processes)
+            self._check_sizes(processes)
+
+        if len(self.errors) > 0:
+            raise ValueError("Invalid pipeline :\n- " + "\n- ".join(self.errors))
+
+        return Pipeline(audio, inputs[0], tuple(processes.values()))
+
+    def _audio(self, audio):
+        if audio is None or any(audio.get(key) is None for key in ('rate', 'sample_width', 'channels')):
+            self.error("The `audio` section should have a rate, a sample_width and channels.")
+            return AudioSpec(16000, 2, 1, 0.0)
+
+        return AudioSpec(
+            rate=int(audio['rate']),
+            sample_width=int(audio['sample_width']),
+            channels=int(audio['channels']),
+            file_duration=float(audio.get('file_duration') or 0.0),
+            channel=audio.get('channel'),
+            mmap_threshold=audio.get('mmap_threshold') or (1 << 20)
+        )
+
+    def _process(self, process, audio):
+        name = process['name']
+        process_type = process.get('type')
+        if process_type not in PROCESS_TYPES:
+            self.error("Process '{}' : unknown type '{}', should be one of {}.", name, process_type, tuple(PROCESS_TYPES))
+        if process.get('model') is None and process_type != 'gate':
+            self.error("Process '{}' has no model.", name)
+
+        delegate = process.get('delegate') or 'xnnpack'
+        if delegate not in DELEGATES:
+            self.error("Process '{}' : unknown delegate '{}', should be one of {}.", name, delegate, DELEGATES)
+
+        cache = None
+        if process.get('cache'):
+            raw_cache = process['cache']
+            cache = CacheSpec(
+                size=raw_cache.get('size') or 64,
+                ttl=raw_cache['ttl'] if raw_cache.get('ttl') is not None else 60,
+                fingerprint=raw_cache.get('fingerprint') or 'hash',
+                resolution=raw_cache.get('resolution')
+            )
+            if cache.fingerprint not in ResultCache.FINGERPRINTS:
+                self.error("Process '{}' : unknown cache fingerprint '{}'.", name, cache.fingerprint)
+
+        log = process.get('log')
+        return ProcessSpec(
+            name=name,
+            type=process_type,
+            model=process.get('model'),
+            position=process.get('position'),
+            workers=process.get('workers') or 1,
+            num_threads=process.get('num_threads'),
+            delegate=delegate,
+            zero_copy=bool(process.get('zero_copy')),
+            rate=int(process.get('rate') or audio.rate),
+            cache=cache,
+            config=self._model_config(name, process_type, process.get('config') or {}),
+            log=log,
+            log_string=self._line(log) if log else None
+        )
+
+    def _model_config(self, name, process_type, config):
+        input_shape = config.get('input_shape')
+        if input_shape is not None:
+            if not isinstance(input_shape, list) or not all(isinstance(size, int) and size > 0 for size in input_shape):
+                self.error("Process '{}' : input_shape should be a list of positive integers, not {}.", name, input_shape)
+            input_shape = tuple(input_shape)
+        elif process_type != 'gate':
+            self.error("Process '{}' has no input_shape.", name)
+
+        if config.get('preprocess') not in PREPROCESSORS:
+            self.error("Process '{}' : unknown preprocess '{}'.", name, config.get('preprocess'))
+        if process_type == 'classification' and config.get('labels') is None:
+            self.error("Process '{}' has no labels.", name)
+
+        fields = ('input_shape', 'preprocess', 'threshold', 'labels', 'minimum_confidence', 'count')
+        return ModelConfig(
+            input_shape=input_shape,
+            preprocess=config.get('preprocess'),
+            threshold=config.get('threshold'),
+            labels=config.get('labels'),
+            minimum_confidence=config.get('minimum_confidence'),
+            count=config.get('count'),
+            extra=MappingProxyType({key: value for key, value in config.items() if key not in fields})
+        )
+
+    def _actions(self, process, actions, processes):
+        kept_layers = set()
+        compiled = {}
+        for kind in ('on_result', 'on_not_result', 'always'):
+            compiled[kind] = []
+            for action in actions.get(kind) or []:
+                if kind == 'always':
+                    condition = None
+                else:
+                    condition, action = list(action.items())[0]
+                    try:
+                        ActionTriggerCollection(condition)
+                    except (ValueError, IndexError) as error:
+                        self.error("Process '{}' : invalid condition '{}' ({}).", process.name, condition, error)
+
+                action = self._action(process, action or {}, processes)
+                if action.action == 'next' and isinstance(action.input, int):
+                    kept_layers.add(action.input)
+                if action.line_string is not None:
+                    kept_layers.update(int(argument or 0) for argument in action.line_string.arguments('l'))
+
+                compiled[kind].append(action if condition is None else (condition, action))
+
+        if process.log_string is not None:
+            kept_layers.update(int(argument or 0) for argument in process.log_string.arguments('l'))
+
+        # The ProcessSpec is frozen for the users of the pipeline, and only completed here
+        object.__setattr__(process, 'actions', ActionsSpec(tuple(compiled['on_result']), tuple(compiled['on_not_result']), tuple(compiled['always'])))
+        object.__setattr__(process, 'kept_layers', frozenset(kept_layers))
+
+    def _action(self, process, action, processes):
+        action_type = action.get('action')
+        if action_type not in ACTION_TYPES:
+            self.error("Process '{}' : unknown action type '{}'.", process.name, action_type)
+            return ActionSpec(None)
+
+        if action_type == 'next':
+            target = processes.get(action.get('target'))
+            if target is None:
+                self.error("Process '{}' : target process '{}' does not exist.", process.name, action.get('target'))
+            elif target.position == 'input':
+                self.error("Process '{}' : the input process '{}' cannot be a target.", process.name, target.name)
+
+            action_input = action.get('input')
+            if str(action_input).isnumeric():
+                action_input = int(action_input)
+            elif action_input not in INPUT_TYPES:
+                self.error("Process '{}' : `input` of the 'next' action should be 'same', 'result' or an int, not {}.", process.name, action_input)
+            return ActionSpec('next', target=target, input=action_input)
+
+        if action_type == 'save':
+            return ActionSpec('save', filename_string=self._filename(action.get('filename')), directory_string=self._directory(action.get('directory')))
+        if action_type == 'log':
+            return ActionSpec('log', line_string=self._line(action.get('line')))
+        return ActionSpec(action_type)
+
+    @staticmethod
+    def _filename(filename):
+        if filename is None or filename == 'default':
+            filename = DEFAULT_FILENAME
+
+        filename = str(filename)
+        if not filename.endswith('.wav'):
+            filename += '.wav'
+        return CustomString(filename, sanitize=True)
+
+    def _directory(self, directory):
+        if directory is None or directory == 'default':
+            directories = self.config.directories
+            if directories is None or directories.save_dir is None:
+                self.error("`directories.save_dir` is needed by the 'save' actions without directory.")
+                return None
+            directory = os.path.join(directories.save_dir, '%c')
+        return CustomString(str(directory))
+
+    @staticmethod
+    def _line(line):
+        if line is None or line == 'default':
+            line = DEFAULT_LINE
+        return CustomString(str(line))
+
+    def _check_cycles(self, processes):
+        """Check that no process can be run again by its own 'next' actions."""
+
+        # 0 : not visited, 1 : being visited, 2 : done
+        states = {name: 0 for name in processes}
+
+        def visit(process, path):
+            states[process.name] = 1
+            for action in process.actions.all():
+                if action.action != 'next':
+                    continue
+                if states[action.target.name] == 1:
+                    cycle = path[path.index(action.target.name):] + [action.target.name]
+                    self.error("The processes form a cycle : {}.", ' -> '.join(cycle))
+                elif states[action.target.name] == 0:
+                    visit(action.target, path + [action.target.name])
+            states[process.name] = 2
+
+        for process in processes.values():
+            if states[process.name] == 0:
+                visit(process, [process.name])
+
+    def _check_sizes(self, processes):
+        """Check that the audio given with `input: same` has the size of the input of the target (at its sample rate)."""
+
+        for process in processes.values():
+            for action in process.actions.all():
+                if action.action != 'next' or action.input != 'same':
+                    continue
+                source_shape, target_shape = process.config.input_shape, action.target.config.input_shape
+                if source_shape is None or target_shape is None:
+                    continue
+
+                size = math.prod(source_shape) * action.target.rate / process.rate
+                if size != math.prod(target_shape):
+                    self.error(
+                        "Process '{}' gives {:g} samples to '{}', whose input_shape {} needs {}.",
+                        process.name, size, action.target.name, list(target_shape), math.prod(target_shape)
+                    )
+
+
+def compile_pipeline(config):
+    """Return the `Pipeline` of the config (`config.Config`), or raise a ValueError listing all the errors of the config."""
+
+    return _Compiler(config).compile()
+
+
+def check_models(pipeline):
+    """
+    Load the models of the pipeline and return the list of the errors found : unknown output layers
+    (input of the 'next' actions, `%l` placeholders), and output layers whose size is not the input size of their target.
+    """
+
+    errors = []
+    pools = {}
+    for process in pipeline.processes:
+        if process.model is None:
+            continue
+        try:
+            pools[process.name] = registry.get_pool(process.model, process.config.input_shape, 1, process.num_threads, process.delegate)
+        except (ValueError, RuntimeError, OSError) as error:
+            errors.append("Process '{}' : cannot load the model '{}' ({}).".format(process.name, process.model, error))
+
+    for process in pipeline.processes:
+        pool = pools.get(process.name)
+        if pool is not None:
+            errors.extend(check_pool(process, pool))
+
+    return errors
+
+
+def check_pool(process, pool):
+    """Return the list of the errors of the compiled process with the interpreters of its model (see `check_models`)."""
+
+    errors = []
+    for position in sorted(process.kept_layers):
+        if position >= len(pool.output_layers):
+            errors.append("Process '{}' uses the output layer {}, but its model only has {}.".format(process.name, position, len(pool.output_layers)))
+
+    for action in process.actions.all():
+        if action.action != 'next' or not isinstance(action.input, int) or action.input >= len(pool.output_layers):
+            continue
+        shape = pool.output_shapes.get(pool.output_layers[action.input])
+        target_shape = action.target.config.input_shape
+        if shape is not None and target_shape is not None and math.prod(shape) != math.prod(target_shape):
+            errors.append("Process '{}' gives its output layer {} of shape {} to '{}', whose input_shape is {}.".format(
+                process.name, action.input, list(shape), action.target.name, list(target_shape)
+            ))
+
+    return errors
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Check a config and the models of its pipe, without processing anything.')
+    parser.add_argument('config', nargs='?', default='config.yml', help='config file (default : config.yml)')
+    parser.add_argument('--no-models', action='store_true', help='only check the config, without loading the models')
+    args = parser.parse_args()
+
+    try:
+        pipeline = Config(args.config).pipeline
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+
+    errors = [] if args.no_models else check_models(pipeline)
+    for error in errors:
+        print('- ' + error)
+    if len(errors) > 0:
+        sys.exit(1)
+
+    print("'{}' : {} processes, OK.".format(args.config, len(pipeline.processes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+import fake_librosa as librosa
+
+from allocations import allocations
+from memory import governor
+from quantization import pcm_to_float
+
+
+class NoPreprocessor:
+    """Pre-processor which returns the audio unchanged."""
+
+    params = (None,)
+    cacheable = False
+    streamable = False
+    accepts_integers = True
+
+    def __init__(self, rate=None):
+        pass
+
+    def process(self, audio):
+        return audio
+
+
+class MfccPreprocessor:
+    """
+    MFCC transform of the sound, equivalent to `librosa.feature.mfcc` (frames centered and padded with zeros),
+    whose window, mel filterbank and DCT matrix are computed once for the sample rate `rate`.
+
+    It is split in three steps (`frames`, `power_spectrum` and `from_power_spectrum`),
+    so the power spectrum of the frames can be reused on overlapping windows of a stream.
+    """
+
+    SAMPLE_RATE = 16000
+    COUNT = 32
+    HOP_LENGTH = 1001
+    FFT_LENGTH = 2048
+    MEL_COUNT = 128
+    TOP_DB = 80.0
+    AMIN = 1e-10
+
+    cacheable = True
+    streamable = True
+    accepts_integers = False
+
+    def __init__(self, rate=None):
+        self.rate = rate or MfccPreprocessor.SAMPLE_RATE
+        self.params = ('mfcc', self.rate, MfccPreprocessor.COUNT, MfccPreprocessor.HOP_LENGTH, MfccPreprocessor.FFT_LENGTH, MfccPreprocessor.MEL_COUNT)
+
+        # Periodic Hann window
+        self.window = np.hanning(MfccPreprocessor.FFT_LENGTH + 1)[:-1].astype(np.float32)
+        self.mel_basis = librosa.filters.mel(
+            sr=self.rate,
+            n_fft=MfccPreprocessor.FFT_LENGTH,
+            n_mels=MfccPreprocessor.MEL_COUNT
+        ).T
+        self.dct_matrix = self._dct_matrix(MfccPreprocessor.MEL_COUNT)[:MfccPreprocessor.COUNT].T
+
+    @staticmethod
+    def _dct_matrix(size):
+        """Return the matrix of the orthonormal DCT of type II."""
+
+        k, n = np.meshgrid(np.arange(size), np.arange(size), indexing='ij')
+        matrix = np.sqrt(2 / size) * np.cos(np.pi * k * (2 * n + 1) / (2 * size))
+        matrix[0] /= np.sqrt(2)
+        return matrix.astype(np.float32)
+
+    def frames(self, audio):
+        """Return the frames of the audio as a view of shape (frames, FFT_LENGTH), and the position of their centers."""
+
+        padded = np.pad(audio.reshape((-1)), MfccPreprocessor.FFT_LENGTH // 2)
+        frames = np.lib.stride_tricks.sliding_window_view(padded, MfccPreprocessor.FFT_LENGTH)[::MfccPreprocessor.HOP_LENGTH]
+        return (frames, MfccPreprocessor.HOP_LENGTH * np.arange(len(frames)))
+
+    def power_spectrum(self, frames):
+        """Return the power spectrum of the frames, of shape (frames, FFT_LENGTH // 2 + 1)."""
+
+        return np.abs(np.fft.rfft(frames * self.window, axis=1))**2
+
+    def from_power_spectrum(self, power):
+        """Return the MFCC of the frames from their power spectrum, of shape (1, frames, COUNT, 1)."""
+
+        mel = np.log10(np.maximum(MfccPreprocessor.AMIN, power @ self.mel_basis)) * 10
+        mel = np.maximum(mel, mel.max() - MfccPreprocessor.TOP_DB)
+
+        data = mel @ self.dct_matrix
+        data = np.expand_dims(data, axis=0)
+        data = np.expand_dims(data, axis=-1)
+        return data
+
+    def process(self, audio):
+        frames, _ = self.frames(audio)
+        return self.from_power_spectrum(self.power_spectrum(frames))
+
+    def cache_key(self, audio):
+        """The features only depend on the flattened audio."""
+
+        return self.params
+
+
+# Name of the pre-processing in the config -> class of the pre-processor
+PREPROCESSORS = {
+    None: NoPreprocessor,
+    'mfcc': MfccPreprocessor
+}
+
+_preprocessors = {}
+_preprocessors_lock = threading.Lock()
+
+
+def get_preprocessor(name, rate=None):
+    """Return the pre-processor with this name for audio sampled at `rate` Hz, which is created once and shared by all the processes."""
+
+    if name not in PREPROCESSORS:
+        raise ValueError("Unknown preprocess : '{}'".format(name))
+
+    key = (name, rate)
+    with _preprocessors_lock:
+        if key not in _preprocessors:
+            _preprocessors[key] = PREPROCESSORS[name](rate)
+        return _preprocessors[key]
+
+
+class FeatureCache:
+    """
+    LRU cache of the pre-processed features, keyed by the identity of the input array and the parameters of the pre-processor,
+    so the processes receiving the same data in a pipe (`input: same`) only compute them once.
+
+    An entry keeps a reference to its input array, so its identity cannot be reused by another one while the entry exists.
+    The input arrays should not be modified in place, and the cached features are read-only.
+
+    `memory` returns the number of bytes of the entries, input arrays included (which can also be used by clips in flight).
+    """
+
+    def __init__(self, size=16):
+        self.size = size
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, data, params, compute):
+        """Return the features of the data for these parameters, calling `compute()` if they are not cached."""
+
+        if self.size <= 0:
+            return compute()
+
+        key = (id(data), params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is data:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        features = compute()
+        features.flags.writeable = False
+        allocations.count('preprocess', features)
+
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                self._bytes -= previous[0].nbytes + previous[1].nbytes
+            self._entries[key] = (data, features)
+            self._entries.move_to_end(key)
+            self._bytes += data.nbytes + features.nbytes
+            while len(self._entries) > self.size:
+                _, (old_data, old_features) = self._entries.popitem(last=False)
+                self._bytes -= old_data.nbytes + old_features.nbytes
+
+        return features
+
+    def memory(self):
+        return self._bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+# Cache shared by all the processes
+feature_cache = FeatureCache()
+governor.add_source('features', feature_cache.memory, feature_cache.clear)
+
+
+class Preprocess:
+    """
+    Class which applies the pre-processing of a process.
+
+    To add a new one, create a new pre-processor class with a `process` method and add it to `PREPROCESSORS`.
+    It is created with the sample rate of the audio of the process (`rate` argument).
+    Its `accepts_integers` attribute tells if it can be given PCM integers, otherwise they are converted to float first.
+
+    `process_stream` is used on overlapping windows of a stream : the power spectrum of the frames
+    already seen in the previous window is reused (for the pre-processors which are `streamable`).
+    """
+
+    def __init__(self, preprocess, rate=None):
+        self.preprocessor = get_preprocessor(preprocess, rate)
+
+        # Power spectrum of the frames of the last window, by position of their center in the stream
+        self._stream_frames = {}
+
+    def process(self, audio, cache_key=None):
+        """
+        Pre-process the audio.
+
+        If `cache_key` is given (usually the array the audio is a view of), the features are shared through `feature_cache`
+        with the other processes getting the same array.
+
+        PCM integers are converted to float before being given to a pre-processor, and given as is to `NoPreprocessor`.
+        """
+
+        if cache_key is None or not self.preprocessor.cacheable:
+            return self._process(audio)
+
+        return feature_cache.get(cache_key, self.preprocessor.cache_key(audio), lambda: self._process(audio))
+
+    def _process(self, audio):
+        if not self.preprocessor.accepts_integers:
+            audio = pcm_to_float(audio)
+        return self.preprocessor.process(audio)
+
+    def reuses_stream_frames(self, hop):
+        """Return True if the frames of a window can be reused by the next window of a stream, which starts `hop` samples later."""
+
+        return self.preprocessor.streamable and hop % self.preprocessor.HOP_LENGTH == 0
+
+    def process_stream(self, audio, start):
+        """
+        Pre-process a window of a stream, whose first sample is the sample `start` of the stream.
+
+        Only the frames entirely inside both windows can be reused, so the hop of the stream should be a multiple of the hop of the frames.
+        """
+
+        audio = pcm_to_float(audio)
+        if not self.preprocessor.streamable:
+            return self.preprocessor.process(audio)
+
+        audio = audio.reshape((-1))
+        frames, centers = self.preprocessor.frames(audio)
+        half_length = frames.shape[1] // 2
+        inside = (centers >= half_length) & (centers + half_length <= len(audio))
+
+        power = np.empty((len(frames), half_length + 1), dtype=np.float32)
+        missing = []
+        for k, center in enumerate(centers):
+            frame = self._stream_frames.get(start + center) if inside[k] else None
+            if frame is None:
+                missing.append(k)
+            else:
+                power[k] = frame
+
+        if len(missing) > 0:
+            power[missing] = self.preprocessor.power_spectrum(frames[missing])
+
+        self._stream_frames = {start + centers[k]: power[k] for k in np.flatnonzero(inside)}
+
+        return self.preprocessor.from_power_spectrum(power)
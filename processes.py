@@ -2,170 +2,423 @@
 
 from collections import Counter
 import enum
+import itertools
+import logging
 import operator
-import os
-import random
 import re
+import threading
 import time
 import wave
 
 import numpy as np
-import fake_librosa as librosa
-import tflite_runtime.interpreter as tflite
 
-from config import DotDict
-from action_trigger import ActionTriggerCollection
+from action_trigger import ActionTriggerCollection, BatchHistogram, ResultHistogram
+from allocations import allocations
+from interpreter_pool import registry
+from labels import load_labels
+from metrics import metrics
+from preprocessing import Preprocess
+from quantization import ModelOutputs, pcm_to_float
+from result_cache import get_result_cache
 
 
-class Preprocess:
-    """
-    Class which contains all the pre-processing algorithms.
-
-    To add a new one, create a new function and add a new line in __init__.
-    """
-
-    def __init__(self, preprocess):
-        if preprocess is None:
-            self.process = self._none
-        elif preprocess == 'mfcc':
-            self.process = self._mfcc
-        else:
-            raise ValueError("Unknown preprocess : '{}'".format(preprocess))
-    
-    def _none(self, audio):
-        return audio
-    
-    def _mfcc(self, audio):
-        """Return MFCC transform of the sound."""
-
-        data = np.transpose(librosa.feature.mfcc(y=audio.reshape((-1)), sr=16000, n_mfcc=32, hop_length=1001))
-        data = np.expand_dims(data, axis=0)
-        data = np.expand_dims(data, axis=-1)
-        return data
+logger = logging.getLogger(__name__)
 
 
 class Process:
     """Class to manage processes of the pipe.
-    To create a new one, make a new class inheriting this one and overload the `process` method.
-    This method sould return `self.results` which is of the following form :
+    To create a new one, make a new class inheriting this one, overload the `_post_process` method and add it to `PROCESS_TYPES`.
+    It is created from the compiled process (`pipeline.ProcessSpec`), whose `config` also gives the custom keys of its config.
+    This method receives the (preprocessed) input data and the output of the first layer of the model,
+    and sould return `self.results` which is of the following form :
 
     {'classes': [list of returned names], 'values': [corresponding values], 'params': {any necessary params}}
 
-    The `process` method should call `self._clear_results()` before doing anything to `self.results`
+    The `_post_process` method should call `self._clear_results()` before doing anything to `self.results`
     then `self._normalize_results()` before returning.
+
+    `self.results` and `self.model_outputs` are specific to each thread, so the same process can be run
+    by several threads at once (at most `workers` at the same time, each with its own interpreter).
+
+    The interpreters are shared with all the processes using the same model and input shape (see `interpreter_pool.registry`),
+    so a process only holds the state specific to its client.
+
+    Quantized models (integer input or outputs) are supported : the input is quantized and the outputs dequantized (on first access)
+    with the parameters of their tensors. Integer data is considered as PCM samples (see `Processing._load_audio`),
+    and is given to `_post_process` as float, unless `uses_input_data` is False.
+    If `compare_quantized` is True, `_post_process` receives the quantized input and output of the model instead.
+
+    With `zero_copy`, the input is written directly in the input tensor of the interpreter, and the outputs are views of its tensors,
+    only fetched when they are used (see `quantization.ModelOutputs`). The interpreter then stays checked out until `release_outputs`
+    is called after the actions of the run, and `_post_process` should not keep references to the output.
     """
 
+    uses_input_data = True
+    compare_quantized = False
+
     def __init__(self, process):
+        self._local = threading.local()
         self.name = process.name
+        self.type = process.type
         self.model_outputs = []
         self.results = None
         self.shape = process.config.input_shape
+        self.zero_copy = bool(process.zero_copy)
+        # Sample rate of the audio given to the process, in Hz (see `Processing._create_process`)
+        self.rate = process.rate
 
-        self.interpreter = tflite.Interpreter(model_path=process.model)
-        self.input_layer = self.interpreter.get_input_details()[0]['index']
-        self.output_layers = []
-        for output_details in self.interpreter.get_output_details():
-            self.output_layers.append(output_details['index'])
-        print(self.name, self.output_layers)
-        # self.output_layer = self.interpreter.get_output_details()[0]['index']
-        self.interpreter.resize_tensor_input(self.input_layer, self.shape, strict=True)
-        self.interpreter.allocate_tensors()
+        self._load_model(process)
 
-        self.preprocessing = Preprocess(process.config.preprocess)
+        self.preprocessing = Preprocess(process.config.preprocess, self.rate)
+        self.result_cache = get_result_cache(self.name, process.model, process.cache) if process.cache else None
 
         self.log = process.log
+        # Number of the runs formatted in a CustomString (`%s`)
+        self.sequence = itertools.count(1)
+
+        self.log_string = process.log_string
 
         self._create_on_result_actions(process)
         self._create_on_not_result_actions(process)
         self._create_always_actions(process)
 
-    def _get_model_output(self, data, return_input_data=False):
-        """Return output of the model, with or without the input data."""
+        # Positions of the output layers still needed after the run (input of the 'next' actions, `%l` placeholders)
+        self.kept_layers = process.kept_layers
+
+    def _load_model(self, process):
+        """Get the interpreters of the model of the process."""
+
+        self.interpreters = registry.get_pool(process.model, self.shape, process.workers or 1, process.num_threads, process.delegate)
+        self.input_layer = self.interpreters.input_layer
+        self.output_layers = self.interpreters.output_layers
+        self.input_quantization = self.interpreters.input_quantization
+        self.output_quantizations = self.interpreters.output_quantizations
+        logger.debug("Process '%s' - output layers : %s", self.name, self.output_layers)
+
+    @property
+    def accepts_integer_audio(self):
+        """True if the audio can be given as PCM integers, without converting it to float first."""
+
+        return self.interpreters is not None and self.input_quantization.is_quantized and self.preprocessing.preprocessor.accepts_integers
+
+    @property
+    def results(self):
+        """Results of the last run of the process in the current thread."""
+
+        return getattr(self._local, 'results', None)
+
+    @results.setter
+    def results(self, results):
+        self._local.results = results
+
+    @property
+    def model_outputs(self):
+        """Outputs of the model of the last run of the process in the current thread."""
+
+        return getattr(self._local, 'model_outputs', None)
+
+    @model_outputs.setter
+    def model_outputs(self, model_outputs):
+        self._local.model_outputs = model_outputs
+
+    def _invoke(self, data, zero_copy=False):
+        """
+        Run the model on the already preprocessed data and return the outputs of all its layers, as `ModelOutputs`.
+
+        If `zero_copy` is True and the process uses it, see `_invoke_zero_copy`.
+        """
+
+        if zero_copy and self.zero_copy:
+            return self._invoke_zero_copy(data)
+
+        with self.interpreters.checkout() as pooled_interpreter:
+            pooled_interpreter.resize_input(data.shape)
+            interpreter = pooled_interpreter.interpreter
+
+            start = time.perf_counter()
+            tensor = self.input_quantization.quantize(data)
+            interpreter.set_tensor(self.input_layer, tensor)
+            start = metrics.observe('set_tensor', self.name, start)
+            interpreter.invoke()
+            start = metrics.observe('invoke', self.name, start)
+
+            outputs = {}
+            for index in self.output_layers:
+                outputs[index] = interpreter.get_tensor(index)
+                outputs[index].flags.writeable = False
+                allocations.count('get_tensor', outputs[index])
+            metrics.observe('get_tensor', self.name, start)
+        return ModelOutputs(outputs, self.output_quantizations, tensor)
+
+    def _invoke_zero_copy(self, data):
+        """
+        Run the model without copying its input and outputs : the data is written in the input tensor of the interpreter,
+        and the returned `ModelOutputs` are views of its output tensors, fetched on first access.
+
+        The interpreter stays checked out by the current thread until `release_outputs` is called.
+        """
+
+        # In case the previous run of the thread was not released
+        self.release_outputs()
+
+        pooled_interpreter = self.interpreters.acquire()
+        try:
+            pooled_interpreter.resize_input(data.shape)
+            interpreter = pooled_interpreter.interpreter
+
+            start = time.perf_counter()
+            # The view must not exist anymore when the interpreter is invoked
+            tensor = self.input_quantization.quantize_into(data, interpreter.tensor(self.input_layer)())
+            start = metrics.observe('set_tensor', self.name, start)
+            interpreter.invoke()
+            metrics.observe('invoke', self.name, start)
+        except Exception:
+            self.interpreters.release(pooled_interpreter)
+            raise
+
+        outputs = ModelOutputs({}, self.output_quantizations, tensor, fetch=lambda index: interpreter.tensor(index)())
+        self._local.checked_out = (pooled_interpreter, outputs)
+        return outputs
+
+    def release_outputs(self):
+        """
+        Give back the interpreter checked out by the last zero-copy run of the current thread, once the outputs still needed
+        (those already used and the `kept_layers`) have been copied. Does nothing if there is no such run.
+        """
+
+        checked_out = getattr(self._local, 'checked_out', None)
+        if checked_out is None:
+            return
 
-        data = data.reshape(self.shape)
-        data = self.preprocessing.process(data)
+        self._local.checked_out = None
+        pooled_interpreter, outputs = checked_out
+        try:
+            outputs.release([self.output_layers[k] for k in self.kept_layers if k < len(self.output_layers)])
+        finally:
+            self.interpreters.release(pooled_interpreter)
+
+    def end_run(self):
+        """
+        End the run of the current thread once its actions are executed : the interpreter is released (see `release_outputs`),
+        and the results and outputs of the run are forgotten, so they do not stay in memory until the next run of the thread.
+        The data given to the next processes and the strings still to be formatted keep their own references.
+        """
+
+        self.release_outputs()
+        self.model_outputs = None
+        self.results = None
 
-        self.interpreter.set_tensor(self.input_layer, data.astype('float32'))
-        self.interpreter.invoke()
+    def _get_model_output(self, data, return_input_data=False, stream_start=None):
+        """
+        Return output of the model, with or without the input data.
 
-        self.model_outputs = {}
-        for index in self.output_layers:
-            self.model_outputs[index] = self.interpreter.get_tensor(index)
+        If the data is a window of a stream, `stream_start` is the position of its first sample in the stream.
+        """
+
+        start = time.perf_counter()
+        if stream_start is None:
+            data = self.preprocessing.process(data.reshape(self.shape), cache_key=data)
+        else:
+            data = self.preprocessing.process_stream(data.reshape(self.shape), stream_start)
+        metrics.observe('preprocess', self.name, start)
+
+        self.model_outputs = self._invoke(data, zero_copy=True)
+
+        if self.compare_quantized:
+            data, output = self.model_outputs.input, self.model_outputs.get_raw(self.output_layers[0])
+        else:
+            output = self.model_outputs[self.output_layers[0]]
+            if return_input_data and self.uses_input_data:
+                data = pcm_to_float(data)
 
         if return_input_data:
-            return (data, self.model_outputs[self.output_layers[0]])
+            return (data, output)
         else:
-            return self.model_outputs[self.output_layers[0]]
+            return output
+
+    def _get_batch_model_outputs(self, batch):
+        """
+        Generator of the (preprocessed) input data and the outputs of the model for every element of the batch.
+
+        All the data are concatenated along their first axis so that the model is invoked only once.
+        If it is not possible (1D input, different shapes or outputs which cannot be split), the model is invoked once per element.
+        """
+
+        start = time.perf_counter()
+        inputs = [self.preprocessing.process(data.reshape(self.shape), cache_key=data) for data in batch]
+        metrics.observe('preprocess', self.name, start)
+
+        if len(inputs) > 1 and inputs[0].ndim > 1 and all(data.shape == inputs[0].shape for data in inputs):
+            try:
+                outputs = self._invoke(np.concatenate(inputs, axis=0))
+            except (RuntimeError, ValueError):
+                # The model does not accept a bigger first dimension
+                outputs = None
+
+            if outputs is not None and all(outputs.raw[index].shape[0] % len(inputs) == 0 for index in self.output_layers):
+                splitted_outputs = {index: np.split(outputs[index], len(inputs)) for index in self.output_layers}
+                for k, data in enumerate(inputs):
+                    yield (self._real_input(data), {index: layers[k] for index, layers in splitted_outputs.items()})
+                return
+
+        for data in inputs:
+            yield (self._real_input(data), self._invoke(data))
+
+    def _real_input(self, data):
+        """Return the input data given to `_post_process` when the outputs are dequantized."""
+
+        return pcm_to_float(data) if self.uses_input_data else data
+
+    def _get_cached_results(self, key):
+        """Return a copy of the cached results of the key, and restore their model outputs, or return None."""
+
+        cached = self.result_cache.get(key)
+        if cached is None:
+            return None
+
+        # Shallow copy, so the results are still a new dict at every run
+        self.results = dict(cached[0])
+        self.model_outputs = cached[1]
+        return self.results
+
+    def process(self, data, stream_start=None):
+        """
+        Run the model on the data and return its results. See `_get_model_output` for `stream_start`.
+
+        If the process has a result cache, the results of a data with the same fingerprint are reused.
+        """
+
+        key = None
+        if self.result_cache is not None:
+            key = self.result_cache.key(data)
+            results = self._get_cached_results(key)
+            if results is not None:
+                return results
+
+        input_data, output = self._get_model_output(data, return_input_data=True, stream_start=stream_start)
+
+        start = time.perf_counter()
+        results = self._post_process(input_data, output)
+        metrics.observe('post_process', self.name, start)
+
+        if key is not None:
+            self.result_cache.put(key, results, self.model_outputs)
+        return results
+
+    def process_batch(self, batch):
+        """
+        Generator of the results of the model on every element of the batch, in the same order.
+
+        While the results of an element are yielded, `self.results` and `self.model_outputs` are those of this element,
+        so actions can be executed between two iterations.
+        """
+
+        keys = [None] * len(batch)
+        cached = [None] * len(batch)
+        if self.result_cache is not None:
+            keys = [self.result_cache.key(data) for data in batch]
+            cached = [self.result_cache.get(key) for key in keys]
+
+        # Only the data which are not cached are given to the model
+        model_outputs = self._get_batch_model_outputs([data for data, entry in zip(batch, cached) if entry is None])
+
+        for key, entry in zip(keys, cached):
+            if entry is not None:
+                self.results = dict(entry[0])
+                self.model_outputs = entry[1]
+                yield self.results
+                continue
+
+            data, outputs = next(model_outputs)
+            self.model_outputs = outputs
+
+            start = time.perf_counter()
+            results = self._post_process(data, outputs[self.output_layers[0]])
+            metrics.observe('post_process', self.name, start)
+
+            if key is not None:
+                self.result_cache.put(key, results, outputs)
+            yield results
+
+    def _post_process(self, data, output):
+        """Compute `self.results` from the input data and the output of the model. Should be overloaded."""
+
+        raise NotImplementedError
 
     def _create_on_result_actions(self, process):
         """Create all the "on_result" actions of the process as ActionTriggerCollections."""
 
         self.on_result_actions = list()
-        
-        if process.actions is None or process.actions.on_result is None:
-            return
-        
-        for action_dict in process.actions.on_result:
-            condition, action = list(action_dict.items())[0]
+
+        for condition, action in process.actions.on_result:
             action_triggers = ActionTriggerCollection(condition)
-            self.on_result_actions.append((action_triggers, DotDict(action)))
+            self.on_result_actions.append((action_triggers, action))
 
     def _create_on_not_result_actions(self, process):
         """Create all the "on_not_result" actions of the process as ActionTriggerCollections."""
 
         self.on_not_result_actions = list()
 
-        if process.actions is None or process.actions.on_not_result is None:
-            return
-
-        for action_dict in process.actions.on_not_result:
-            condition, action = list(action_dict.items())[0]
+        for condition, action in process.actions.on_not_result:
             action_triggers = ActionTriggerCollection(condition)
-            self.on_not_result_actions.append((action_triggers, DotDict(action)))
-        
+            self.on_not_result_actions.append((action_triggers, action))
+
     def _create_always_actions(self, process):
         """Create all the "always" actions of the process."""
 
-        self.on_always_actions = list()
+        self.on_always_actions = list(process.actions.always)
 
-        if process.actions is None or process.actions.always is None:
-            return
-
-        for action in process.actions.always:
-            self.on_always_actions.append(DotDict(action))
 
+    def get_on_result_actions(self, result, histogram=None):
+        """Generator for all the "on_result" actions satisfying the given result (whose histogram can be given to share it)."""
 
-    def get_on_result_actions(self, result):
-        """Generator for all the "on_result" actions satisfying the given result."""
+        if histogram is None:
+            histogram = ResultHistogram(result)
 
         for action_trigger, action in self.on_result_actions:
-            if action_trigger.is_valid(result):
+            if action_trigger.is_valid(result, histogram):
                 yield action
 
-    def get_on_not_result_actions(self, result):
-        """Generator for all the "on_not_result" actions satisfying the given result."""
+    def get_on_not_result_actions(self, result, histogram=None):
+        """Generator for all the "on_not_result" actions satisfying the given result (whose histogram can be given to share it)."""
+
+        if histogram is None:
+            histogram = ResultHistogram(result)
 
         for action_trigger, action in self.on_not_result_actions:
-            if not action_trigger.is_valid(result):
+            if not action_trigger.is_valid(result, histogram):
                 yield action
-    
+
+    def evaluate_triggers_batch(self, results):
+        """
+        Evaluate the triggers of all the "on_result" and "on_not_result" actions on several results at once.
+
+        Return two boolean arrays of shape (number of results, number of actions) indicating which actions should be executed.
+        """
+
+        histogram = BatchHistogram(results)
+        on_result = np.zeros((len(results), len(self.on_result_actions)), dtype=bool)
+        on_not_result = np.zeros((len(results), len(self.on_not_result_actions)), dtype=bool)
+
+        for k, (action_trigger, _) in enumerate(self.on_result_actions):
+            on_result[:, k] = action_trigger.is_valid_batch(results, histogram)
+        for k, (action_trigger, _) in enumerate(self.on_not_result_actions):
+            on_not_result[:, k] = ~action_trigger.is_valid_batch(results, histogram)
+
+        return (on_result, on_not_result)
+
     def get_always_actions(self):
         """Yield all the always actions"""
 
         yield from self.on_always_actions
-    
-    
-    def replace_string(self, string, client_id, shortened=False):
-        """Replace the CustomString with all the necessary fields. Add more if needed."""
 
-        string = string.replace('%n', self.name.lower())
-        string = string.replace('%r', str(self.results['classes']).lower()[:50])
-        string = string.replace('%R', str(self.results['classes']).lower())
-        string = string.replace('%d', time.strftime('%Y_%m_%d-%H_%M_%S'))
-        string = string.replace('%a', str(random.randint(1000, 9999)))
-        string = string.replace('%c', client_id)
-        return string
+    def has_next_actions(self):
+        """Return True if the process has at least one 'next' action."""
 
+        actions = [action for _, action in self.on_result_actions + self.on_not_result_actions] + self.on_always_actions
+        return any(action.action == 'next' for action in actions)
+    
+    
     def _clear_results(self):
         """Clear the `self.results` variable."""
 
@@ -184,7 +437,6 @@ class Process:
         self.results['classes'] = list(map(lambda res: str(res).lower(), self.results['classes']))
 
     def get_result_of_layer(self, index):
-        print(self.name, index, self.output_layers)
         if index >= len(self.output_layers):
             raise IndexError('Model only has {} layers, and you tried to access index {}'.format(len(self.output_layers), index))
 
@@ -194,20 +446,20 @@ class Process:
             raise ValueError('Model outputs have not been computed yet.')
         if not layer_index in self.model_outputs:
             raise IndexError("Model has no layer of index {}".format(layer_index))
-        
+
+        if isinstance(self.model_outputs, ModelOutputs):
+            # Still valid once the interpreter of a zero-copy run is released
+            return self.model_outputs.detach(layer_index)
         return self.model_outputs[layer_index]
 
 
     @staticmethod
     def create_process(process):
-        """Create the right Process class based on the DotDict."""
+        """Create the right Process class based on the compiled process (`pipeline.ProcessSpec`)."""
 
-        if process.type == 'anomaly':
-            return AnomalyProcess(process)
-        elif process.type == 'classification':
-            return ClassificationProcess(process)
-        else:
+        if process.type not in PROCESS_TYPES:
             raise ValueError("Unknown process type : '{}'.".format(process.type))
+        return PROCESS_TYPES[process.type](process)
 
 
 class AnomalyProcess(Process):
@@ -224,13 +476,18 @@ class AnomalyProcess(Process):
     def __init__(self, process):
         super().__init__(process)
         self.threshold = process.config.threshold
-    
-    def process(self, data):
-        data, results = self._get_model_output(data, return_input_data=True)
 
+        # With the same quantization parameters for the input and the output, |x - y| = scale * |qx - qy|
+        self.compare_quantized = self.input_quantization.same_as(self.output_quantizations[self.output_layers[0]])
+
+    def _post_process(self, data, results):
         self._clear_results()
 
-        self.results['values'] = np.max(np.abs(data - results), axis=(1, 2))
+        if data.dtype.kind in 'iu':
+            difference = np.abs(np.subtract(data, results, dtype=np.int16))
+            self.results['values'] = np.max(difference, axis=(1, 2)) * self.input_quantization.scale
+        else:
+            self.results['values'] = np.max(np.abs(data - results), axis=(1, 2))
         self.results['classes'] = self.results['values'] > self.threshold
         self.results['params']['threshold'] = self.threshold
         self._normalize_results()
@@ -246,6 +503,9 @@ class ClassificationProcess(Process):
     `self.results['values']` contains the classes confidence.
 
     `self.results['params']` contains the count and minimum confidence.
+
+    `self.results['indices']` and `self.results['confidences']` contain the same results as NumPy arrays of shape (rows, count) :
+    the indexes of the best classes and their confidences, before the minimum confidence is applied.
     """
 
     def __init__(self, process):
@@ -258,38 +518,91 @@ class ClassificationProcess(Process):
 
 
     def load_labels(self, labels):
-        """Read the labels from the file. The file should have one label per line, in the form '<index>,<label>'."""
+        """Load the labels from the file (see `labels.load_labels`). The file should have one label per line, in the form '<index>,<label>'."""
+
+        loaded = load_labels(labels)
+        self.labels = loaded.labels
+        self.label_names = loaded.label_names
+        self.has_label = loaded.has_label
 
-        if not os.path.isfile(labels):
-            raise FileNotFoundError("Labels file '{}' not found.".format(labels))
-        
-        self.labels = {}
-        with open(labels, 'r', encoding='utf-8') as fi:
-            for line in fi.read().splitlines():
-                if line == '':
-                    continue
-                index, names = line.split(',')
-                self.labels[int(index)] = names.lower()
+    def _post_process(self, data, raw_results):
+        count = min(self.count, raw_results.shape[1])
 
-    def process(self, data):
-        raw_results = self._get_model_output(data, return_input_data=False)
+        # Only the `count` best classes of every row are sorted, in decreasing order
+        indices = np.argpartition(raw_results, -count, axis=1)[:, -count:]
+        confidences = np.take_along_axis(raw_results, indices, axis=1)
+        order = np.argsort(-confidences, axis=1, kind='stable')
+        indices = np.take_along_axis(indices, order, axis=1)
+        confidences = np.take_along_axis(confidences, order, axis=1)
 
-        sorted_indexes = raw_results.argsort(1)[:, -self.count:]
-        sorted_results  = np.sort(raw_results, 1)[:, -self.count:]
+        in_labels = indices < len(self.label_names)
+        label_indices = np.where(in_labels, indices, 0)
+        valid = in_labels & self.has_label[label_indices] & (confidences >= self.minimum_confidence)
 
         self._clear_results()
 
-        for y, row in enumerate(sorted_indexes):
-            for x, ind in reversed(list(enumerate(row))):
-                confidence = sorted_results[y, x]
-                if confidence >= self.minimum_confidence and ind in self.labels:
-                    self.results['classes'].append(self.labels[ind])
-                    self.results['values'].append(confidence)
-                else:
-                    self.results['classes'].append('N/A')
-                    self.results['values'].append(0.0)
+        self.results['classes'] = np.where(valid, self.label_names[label_indices], 'N/A').ravel().tolist()
+        self.results['values'] = np.where(valid, confidences, 0.0).ravel().tolist()
+        self.results['indices'] = indices
+        self.results['confidences'] = confidences
 
         self.results['params']['count'] = self.count
         self.results['params']['min_confidence'] = self.minimum_confidence
         self._normalize_results()
         return self.results
+
+
+class GateProcess(Process):
+    """
+    Process without model which rejects the quiet audios, to avoid running the models on them.
+
+    The audio is split in rows (the first dimension of `input_shape`, or a single row without it),
+    and the RMS of every row is compared to the threshold.
+
+    `self.results['class']` contains 'true' if the RMS of the row is above the threshold, else 'false'.
+
+    `self.results['values']` contains the RMS of the rows.
+
+    `self.results['params']` contains the threshold used.
+    """
+
+    def __init__(self, process):
+        super().__init__(process)
+        self.threshold = process.config.threshold or 0.0
+        self.rows = self.shape[0] if self.shape is not None and len(self.shape) > 1 else 1
+
+    def _load_model(self, process):
+        self.interpreters = None
+        self.input_layer = None
+        self.output_layers = []
+
+    def process(self, data, stream_start=None):
+        start = time.perf_counter()
+        self.model_outputs = {}
+
+        rows = data.reshape((self.rows, -1))
+        # Sum of the squares of every row, without allocating the squares (nor overflowing for PCM integers)
+        rms = np.sqrt(np.einsum('ij,ij->i', rows, rows, dtype=np.float64) / rows.shape[1])
+        if data.dtype.kind == 'i':
+            rms /= 2**(8 * data.dtype.itemsize - 1)
+
+        self._clear_results()
+        self.results['values'] = rms
+        self.results['classes'] = rms > self.threshold
+        self.results['params']['threshold'] = self.threshold
+        self._normalize_results()
+
+        metrics.observe('post_process', self.name, start)
+        return self.results
+
+    def process_batch(self, batch):
+        for data in batch:
+            yield self.process(data)
+
+
+# Type of process in the config -> class of the process. To add a new type, add its class here.
+PROCESS_TYPES = {
+    'anomaly': AnomalyProcess,
+    'classification': ClassificationProcess,
+    'gate': GateProcess,
+}
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+
+from allocations import allocations
+
+
+def pcm_to_float(data):
+    """Return the data as float32 : signed integer data is considered as PCM samples and normalized between -1 and 1, other data is unchanged."""
+
+    if data.dtype.kind != 'i':
+        return data
+
+    audio = np.multiply(data, 1 / 2**(8 * data.dtype.itemsize - 1), dtype=np.float32)
+    allocations.count('pcm_to_float', audio)
+    return audio
+
+
+class TensorQuantization:
+    """
+    Type and quantization parameters (real value = scale * (quantized value - zero point)) of a tensor of a model,
+    from its details given by the interpreter. The tensor is quantized if its type is an integer and its scale is not 0.
+    """
+
+    def __init__(self, dtype=np.float32, scale=0.0, zero_point=0):
+        self.dtype = np.dtype(dtype)
+        self.scale = float(scale)
+        self.zero_point = int(zero_point)
+        self.is_quantized = self.dtype.kind in 'iu' and self.scale != 0
+
+    @staticmethod
+    def from_details(details):
+        scale, zero_point = details.get('quantization', (0.0, 0))
+        return TensorQuantization(details['dtype'], scale, zero_point)
+
+    def same_as(self, other):
+        """Return True if the real values of both tensors can be compared through their quantized values."""
+
+        return self.is_quantized and (self.dtype, self.scale, self.zero_point) == (other.dtype, other.scale, other.zero_point)
+
+    def quantize(self, data):
+        """
+        Return the data converted to the type of the tensor.
+
+        Signed integer data is considered as PCM samples (see `pcm_to_float`) : for a quantized tensor, it is quantized
+        without going through float when the ratio of the scales is a power of two.
+        """
+
+        if not self.is_quantized:
+            return pcm_to_float(data).astype(self.dtype, copy=False)
+
+        info = np.iinfo(self.dtype)
+        if data.dtype.kind == 'i':
+            factor = 1 / (2**(8 * data.dtype.itemsize - 1) * self.scale)
+            shift = -math.log2(factor)
+            if shift >= 0 and shift == int(shift):
+                shift = int(shift)
+                # 64 bits for 32-bit samples, so that the rounding offset cannot overflow
+                quantized = data.astype(np.int64 if data.dtype.itemsize >= 4 else np.int32)
+                if shift > 0:
+                    # Rounded to the nearest, ties to even like `np.rint` : half - 1, plus 1 if the truncated result is odd
+                    quantized += (1 << (shift - 1)) - 1 + (np.right_shift(quantized, shift) & 1)
+                    quantized >>= shift
+            else:
+                quantized = np.rint(np.multiply(data, factor, dtype=np.float32))
+        else:
+            quantized = np.rint(np.multiply(data, 1 / self.scale, dtype=np.float32))
+
+        quantized += self.zero_point
+        np.clip(quantized, info.min, info.max, out=quantized)
+        quantized = quantized.astype(self.dtype)
+        allocations.count('quantize', quantized)
+        return quantized
+
+    def quantize_into(self, data, tensor):
+        """
+        Write the data converted to the type of the tensor into `tensor` (a view of the input tensor of the interpreter).
+        Return the quantized data if an intermediate array was needed, else None.
+        """
+
+        if self.is_quantized:
+            quantized = self.quantize(data)
+            np.copyto(tensor, quantized.reshape(tensor.shape))
+            return quantized
+
+        data = data.reshape(tensor.shape)
+        if data.dtype.kind == 'i':
+            np.multiply(data, 1 / 2**(8 * data.dtype.itemsize - 1), out=tensor, casting='unsafe')
+        else:
+            np.copyto(tensor, data, casting='same_kind')
+        return None
+
+    def dequantize(self, data):
+        """Return the real values of the data of the tensor."""
+
+        if not self.is_quantized:
+            return data
+
+        real = np.subtract(data, self.zero_point, dtype=np.float32)
+        real *= self.scale
+        allocations.count('dequantize', real)
+        return real
+
+
+class ModelOutputs(dict):
+    """
+    Outputs of a model by index of layer, dequantized on first access.
+
+    `raw` contains the outputs as returned by the interpreter (see `get_raw`), and `input` the (quantized) input given to it.
+
+    If `fetch` is given, the raw outputs are only fetched with `fetch(index)` when they are accessed : they are views
+    of the tensors of the interpreter, which are only valid until `release` is called, before the interpreter is used again.
+    The outputs which are still needed after it should be obtained with `detach`.
+    """
+
+    def __init__(self, raw, quantizations, input=None, fetch=None):
+        super().__init__()
+        self.raw = raw
+        self.quantizations = quantizations
+        self.input = input
+        self._fetch = fetch
+        # Layers whose output in the dictionary is a view of the interpreter
+        self._views = set()
+
+    def get_raw(self, index):
+        """Return the output of the layer as returned by the interpreter."""
+
+        raw = self.raw.get(index)
+        if raw is None:
+            if self._fetch is None or index not in self.quantizations:
+                raise KeyError(index)
+            raw = self.raw[index] = self._fetch(index)
+        return raw
+
+    def __missing__(self, index):
+        raw = self.get_raw(index)
+        output = self.quantizations[index].dequantize(raw)
+        if output is raw and self._fetch is not None:
+            self._views.add(index)
+        output.flags.writeable = False
+        self[index] = output
+        return output
+
+    def __contains__(self, index):
+        return index in self.raw or (self._fetch is not None and index in self.quantizations)
+
+    def detach(self, index):
+        """Return the output of the layer as an array which stays valid after `release` (copied only if it is a view of the interpreter)."""
+
+        output = self[index]
+        if index in self._views:
+            output = output.copy()
+            output.flags.writeable = False
+            allocations.count('detach', output)
+            self[index] = self.raw[index] = output
+            self._views.discard(index)
+        return output
+
+    def release(self, keep=()):
+        """Detach the outputs already accessed and those of the layers `keep`, and drop the other views of the interpreter."""
+
+        if self._fetch is None:
+            return
+
+        for index in keep:
+            self.detach(index)
+        for index in list(self._views):
+            self.detach(index)
+
+        # The raw outputs of the quantized layers are views, only their dequantized outputs are kept
+        self.raw = {index: raw for index, raw in self.raw.items() if dict.get(self, index) is raw}
+        self._fetch = None
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline re-scoring of archives of recordings : the wave files of a directory tree are run through the processes of the pipe,
+in batches and with a pool of worker processes, and their scores are written in a columnar file (NPZ, or Parquet with pyarrow).
+
+Every process of the pipe scores every file, regardless of the triggers, so the thresholds of the whole cascade
+can be tuned from a single pass : the actions are not executed (nothing is saved nor logged).
+The scores kept are the values of the results (`<process>.values`, one per row of the audio) or, for the classifications,
+the confidences and indexes of the best classes of every row (`<process>.confidences`, `<process>.indices`). `<process>.offsets` gives
+the rows of every file : the rows of the file k are `offsets[k]:offsets[k + 1]`.
+
+With `--sweep`, the number of positive results of every file is computed for several values of a threshold from the scores,
+without running the models again (`<process>.sweep.<param>` and `<process>.sweep.<param>.positives`, of shape (files, values)).
+It can also be done on an existing NPZ output with `--from`.
+
+The results of every batch are written in `<output>.parts`, so an interrupted run is resumed where it stopped.
+
+Exemples :
+    python rescore.py config.yml recordings/ --output scores.npz --workers 4 --batch 16
+    python rescore.py config.yml recordings/ --output scores.npz --sweep anomalies.threshold=0.02:0.08:0.005
+    python rescore.py config.yml --from scores.npz --output sweep.npz --sweep yamnet.minimum_confidence=0.3,0.5,0.7
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import glob
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+from config import Config
+import models
+from models import Processing
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Type of process -> (parameter which can be swept, score compared to it)
+SWEEPS = {
+    'anomaly': ('threshold', 'values'),
+    'gate': ('threshold', 'values'),
+    'classification': ('minimum_confidence', 'confidences'),
+}
+
+
+def find_files(directory):
+    """Return the paths of the wave files of the directory tree, sorted."""
+
+    filenames = []
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        filenames.extend(os.path.join(root, filename) for filename in sorted(files) if filename.lower().endswith('.wav'))
+    return filenames
+
+
+def _process_order(pipeline):
+    """Return the compiled processes in the order of a breadth-first traversal of the pipe from the input process."""
+
+    order = [pipeline.input_process]
+    queue = deque(order)
+    while len(queue) > 0:
+        for action in queue.popleft().actions.all():
+            if action.action == 'next' and action.target not in order:
+                order.append(action.target)
+                queue.append(action.target)
+    return order
+
+
+class Scorer:
+    """
+    Score batches of files with every process of the pipe of the config.
+
+    A process reached by several 'next' actions is run on the data of the first one (in the order of `_process_order`).
+    """
+
+    def __init__(self, config_path):
+        self.processing = Processing(Config(config_path), 'rescore', parallel=False)
+        self.order = _process_order(self.processing.pipeline)
+
+    def _process(self, spec):
+        if spec is self.processing.pipeline.input_process:
+            return self.processing.input_process
+        return self.processing.middle_processes[spec.name]
+
+    def score(self, filenames):
+        """Return the files which could be read, the (file, error) which could not, and the columns of their scores."""
+
+        files, failed, audios = [], [], []
+        for filename in filenames:
+            try:
+                audios.append(self.processing._load_audio(filename))
+                files.append(filename)
+            except (OSError, ValueError, EOFError) as error:
+                failed.append((filename, str(error)))
+
+        # Process name -> input data of every file (None if the process is not reached for this file)
+        inputs = {self.order[0].name: audios}
+        scores = {spec.name: [None] * len(files) for spec in self.order}
+        for spec in self.order:
+            data = inputs.get(spec.name)
+            if data is None:
+                continue
+
+            process = self._process(spec)
+            indexes = [k for k, item in enumerate(data) if item is not None]
+            for k, results in zip(indexes, process.process_batch([data[k] for k in indexes])):
+                scores[spec.name][k] = results
+
+                for action in spec.actions.all():
+                    if action.action != 'next':
+                        continue
+                    target_data = inputs.setdefault(action.target.name, [None] * len(files))
+                    if target_data[k] is None:
+                        target_data[k] = self.processing.get_next_process(process, action, data[k], results['classes'])[1]
+
+        return (files, failed, _columns(scores, len(files)))
+
+
+def _columns(scores, count):
+    """Return the scores of every process for `count` files as flat columns (see the module documentation)."""
+
+    columns = {}
+    for name, file_results in scores.items():
+        fields = {'values': [], 'confidences': [], 'indices': []}
+        rows = np.zeros(count + 1, dtype=np.int64)
+        for k, results in enumerate(file_results):
+            if results is None:
+                continue
+            if 'confidences' in results:
+                fields['confidences'].append(np.asarray(results['confidences'], dtype=np.float32))
+                fields['indices'].append(np.asarray(results['indices'], dtype=np.int32))
+                rows[k + 1] = len(fields['confidences'][-1])
+            else:
+                fields['values'].append(np.asarray(results['values'], dtype=np.float32).reshape((-1)))
+                rows[k + 1] = len(fields['values'][-1])
+
+        columns[name + '.offsets'] = np.cumsum(rows)
+        for field, arrays in fields.items():
+            if len(arrays) > 0:
+                columns['{}.{}'.format(name, field)] = np.concatenate(arrays)
+    return columns
+
+
+def merge_columns(parts):
+    """Concatenate the (files, failed, columns) of several parts, rebasing the offsets."""
+
+    files, failed, columns = [], [], {}
+    for part_files, part_failed, part_columns in parts:
+        for key, column in part_columns.items():
+            if key.endswith('.offsets'):
+                offsets = columns.setdefault(key, [np.zeros(1, dtype=np.int64)])
+                offsets.append(column[1:] + offsets[-1][-1])
+            else:
+                columns.setdefault(key, []).append(column)
+        files.extend(part_files)
+        failed.extend(part_failed)
+
+    return (files, failed, {key: np.concatenate(arrays) for key, arrays in columns.items()})
+
+
+def parse_sweep(sweep):
+    """Parse a sweep 'process.param=v1,v2,...' or 'process.param=start:stop:step' into (process, param, values)."""
+
+    try:
+        target, values = sweep.split('=')
+        process, param = target.rsplit('.', 1)
+        if ':' in values:
+            start, stop, step = map(float, values.split(':'))
+            values = np.arange(start, stop + step / 2, step)
+        else:
+            values = np.array([float(value) for value in values.split(',')])
+    except ValueError:
+        raise ValueError("Invalid sweep '{}', should be 'process.param=v1,v2,...' or 'process.param=start:stop:step'.".format(sweep))
+    return (process, param, values.astype(np.float32))
+
+
+def sweep_columns(pipeline, columns, sweeps):
+    """Return the columns of the sweeps : for every file and value, the number of positive results with this value of the parameter."""
+
+    specs = {process.name: process for process in pipeline.processes}
+    swept = {}
+    for process, param, values in sweeps:
+        spec = specs.get(process)
+        if spec is None:
+            raise ValueError("Unknown process '{}' in the sweep.".format(process))
+        if SWEEPS.get(spec.type, (None,))[0] != param:
+            raise ValueError("The parameter '{}' of the process '{}' (type '{}') cannot be swept.".format(param, process, spec.type))
+        if process + '.offsets' not in columns:
+            raise ValueError("No scores for the process '{}'.".format(process))
+
+        offsets = columns[process + '.offsets']
+        scores = columns.get('{}.{}'.format(process, SWEEPS[spec.type][1]), np.zeros((0,), dtype=np.float32))
+        if scores.ndim == 1:
+            positives = scores[:, None] > values[None, :]
+        else:
+            positives = np.count_nonzero(scores[:, :, None] >= values[None, None, :], axis=1)
+
+        # Sum of the positives of the rows of every file
+        cumulated = np.concatenate([np.zeros((1, len(values)), dtype=np.int64), np.cumsum(positives, axis=0, dtype=np.int64)])
+        key = '{}.sweep.{}'.format(process, param)
+        swept[key] = values
+        swept[key + '.positives'] = (cumulated[offsets[1:]] - cumulated[offsets[:-1]]).astype(np.int32)
+    return swept
+
+
+def write_output(path, files, failed, columns):
+    """Write the columns as NPZ, or as Parquet (one row per file) if the path ends with '.parquet'."""
+
+    if path.endswith('.parquet'):
+        _write_parquet(path, files, columns)
+        if len(failed) > 0:
+            logger.warning('%d files could not be read', len(failed))
+        return
+
+    np.savez_compressed(
+        path,
+        files=np.array(files, dtype=str),
+        failed=np.array([filename for filename, _ in failed], dtype=str),
+        errors=np.array([error for _, error in failed], dtype=str),
+        **columns
+    )
+
+
+def _write_parquet(path, files, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError('pyarrow is needed to write Parquet files, use a .npz output instead.')
+
+    table = {'file': pa.array(files)}
+    offsets = {key[:-len('.offsets')]: column for key, column in columns.items() if key.endswith('.offsets')}
+    for key, column in columns.items():
+        if key.endswith('.offsets') or '.sweep.' in key:
+            continue
+        process = key.split('.')[0]
+        values = pa.array(column.reshape((-1)))
+        if column.ndim > 1:
+            values = pa.FixedSizeListArray.from_arrays(values, column.shape[1])
+        table[key] = pa.ListArray.from_arrays(pa.array(offsets[process].astype(np.int32)), values)
+
+    for key, column in columns.items():
+        if key.endswith('.positives'):
+            for value, positives in zip(columns[key[:-len('.positives')]], column.T):
+                table['{}={:g}'.format(key[:-len('.positives')], value)] = pa.array(positives)
+
+    pq.write_table(pa.table(table), path)
+
+
+def _load_part(path):
+    with np.load(path, allow_pickle=False) as part:
+        columns = {key: part[key] for key in part.files if key not in ('files', 'failed', 'errors')}
+        return (part['files'].tolist(), list(zip(part['failed'].tolist(), part['errors'].tolist())), columns)
+
+
+_scorer = None
+
+
+def _init_worker(config_path):
+    global _scorer
+    models.logger.setLevel(logging.WARNING)
+    _scorer = Scorer(config_path)
+
+
+def _score_in_worker(filenames):
+    return _scorer.score(filenames)
+
+
+def rescore(config_path, directory, output, workers=1, batch=16, sweeps=()):
+    """
+    Score the wave files of the directory tree and write the results in `output` (see the module documentation).
+    The batches already scored by a previous run (in `<output>.parts`) are not scored again.
+    """
+
+    parts_directory = output + '.parts'
+    os.makedirs(parts_directory, exist_ok=True)
+
+    parts = sorted(glob.glob(os.path.join(parts_directory, 'part-*.npz')))
+    done = set()
+    for part in parts:
+        with np.load(part, allow_pickle=False) as content:
+            done.update(content['files'].tolist())
+            done.update(content['failed'].tolist())
+
+    filenames = [filename for filename in find_files(directory) if filename not in done]
+    batches = [filenames[start:start + batch] for start in range(0, len(filenames), batch)]
+    logger.info('%d files to score (%d already scored), in %d batches', len(filenames), len(done), len(batches))
+
+    start = time.perf_counter()
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config_path,))
+        results = executor.map(_score_in_worker, batches)
+    else:
+        executor = None
+        _init_worker(config_path)
+        results = map(_score_in_worker, batches)
+
+    scored = 0
+    try:
+        for number, (files, failed, columns) in enumerate(results, len(parts)):
+            path = os.path.join(parts_directory, 'part-{:06d}.npz'.format(number))
+            # Written under another name first, so an interrupted write is not taken for a finished part
+            np.savez(path + '.tmp.npz', files=np.array(files, dtype=str), failed=np.array([f for f, _ in failed], dtype=str),
+                     errors=np.array([e for _, e in failed], dtype=str), **columns)
+            os.replace(path + '.tmp.npz', path)
+            parts.append(path)
+            scored += len(files) + len(failed)
+            logger.info('Batch %d : %d/%d files (%.1f files/s)', number, scored, len(filenames), scored / (time.perf_counter() - start))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    files, failed, columns = merge_columns([_load_part(part) for part in parts])
+    columns.update(sweep_columns(Config(config_path).pipeline, columns, sweeps))
+    write_output(output, files, failed, columns)
+    shutil.rmtree(parts_directory)
+    logger.info('%d files scored, %d could not be read, written in %s', len(files), len(failed), output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score the wave files of a directory tree with the processes of the pipe.')
+    parser.add_argument('config', help='config file')
+    parser.add_argument('directory', nargs='?', default=None, help='directory of the recordings (default : directories.save_dir of the config)')
+    parser.add_argument('--output', required=True, help='output file (.npz, or .parquet with pyarrow)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--batch', type=int, default=16, help='number of files per batch')
+    parser.add_argument('--sweep', action='append', default=[], help="values of a threshold : 'process.param=v1,v2,...' or 'process.param=start:stop:step'")
+    parser.add_argument('--from', dest='source', default=None, help='NPZ output of a previous run, whose scores are used instead of scoring the files')
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s\t%(levelname)s\t%(name)s  %(message)s")
+    sweeps = [parse_sweep(sweep) for sweep in args.sweep]
+
+    if args.source is not None:
+        with np.load(args.source, allow_pickle=False) as content:
+            files, failed = content['files'].tolist(), list(zip(content['failed'].tolist(), content['errors'].tolist()))
+            columns = {key: content[key] for key in content.files if key not in ('files', 'failed', 'errors') and '.sweep.' not in key}
+        columns.update(sweep_columns(Config(args.config).pipeline, columns, sweeps))
+        write_output(args.output, files, failed, columns)
+        return
+
+    directory = args.directory or Config(args.config).directories.save_dir
+    rescore(args.config, directory, args.output, args.workers, args.batch, sweeps)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+from allocations import allocations
+from memory import estimate_size, governor
+from metrics import metrics
+from quantization import pcm_to_float
+
+
+class ResultCache:
+    """
+    LRU cache, whose entries expire after `ttl` seconds, of the results and model outputs of a process, keyed by a fingerprint of its input.
+
+    The fingerprint can be :
+    - 'hash' : hash of the input quantized to `resolution` (so inputs differing by less than it usually share the same key) ;
+    - 'spectrum' : coarse spectral signature of the input (energy of `SPECTRUM_BANDS` frequency bands, in dB, quantized to `resolution` dB),
+      which also matches audios which are only similar, like stationary noises.
+
+    `memory` returns an estimate of the number of bytes of the cached results and model outputs.
+    """
+
+    FINGERPRINTS = ('hash', 'spectrum')
+    SPECTRUM_FRAMES = 32
+    SPECTRUM_FRAME_LENGTH = 512
+    SPECTRUM_BANDS = 16
+
+    def __init__(self, name, size=64, ttl=60, fingerprint='hash', resolution=None):
+        if fingerprint not in ResultCache.FINGERPRINTS:
+            raise ValueError("Unknown fingerprint '{}', should be one of {}.".format(fingerprint, ResultCache.FINGERPRINTS))
+
+        self.name = name
+        self.size = size
+        self.ttl = ttl
+        self.fingerprint = fingerprint
+        self.resolution = resolution or (1 / 256 if fingerprint == 'hash' else 3.0)
+        self.hits = 0
+        self.misses = 0
+
+        # Key -> (expiry time, results, model outputs, size in bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._window = np.hanning(ResultCache.SPECTRUM_FRAME_LENGTH).astype(np.float32)
+
+    def key(self, data):
+        """Return the fingerprint of the data. PCM integers are fingerprinted like the same audio normalized between -1 and 1."""
+
+        if self.fingerprint == 'hash':
+            factor = 1 / self.resolution
+            if data.dtype.kind == 'i':
+                factor /= 2**(8 * data.dtype.itemsize - 1)
+            quantized = np.rint(np.multiply(data, factor, dtype=np.float32)).astype(np.int32)
+            allocations.count('result_cache', quantized)
+            return (data.shape, hashlib.blake2b(quantized.tobytes(), digest_size=16).digest())
+
+        audio = pcm_to_float(data.reshape((-1)))
+        length = ResultCache.SPECTRUM_FRAME_LENGTH
+        if len(audio) < length:
+            audio = np.pad(audio, (0, length - len(audio)))
+
+        # A few frames evenly spread over the audio
+        starts = np.linspace(0, len(audio) - length, ResultCache.SPECTRUM_FRAMES).astype(int)
+        frames = np.lib.stride_tricks.sliding_window_view(audio, length)[starts]
+        power = np.mean(np.abs(np.fft.rfft(frames * self._window, axis=1))**2, axis=0)
+        bands = np.add.reduceat(power, np.linspace(0, len(power), ResultCache.SPECTRUM_BANDS, endpoint=False).astype(int))
+        signature = np.rint(10 * np.log10(np.maximum(bands, 1e-10)) / self.resolution).astype(np.int16)
+        return (data.shape, signature.tobytes())
+
+    def get(self, key):
+        """Return the cached (results, model outputs) of the key, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self._bytes -= entry[3]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        metrics.increment('result_cache_total', process=self.name, result='miss' if entry is None else 'hit')
+        return None if entry is None else entry[1:3]
+
+    def put(self, key, results, model_outputs):
+        size = estimate_size(results) + estimate_size(model_outputs)
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                self._bytes -= previous[3]
+            self._entries[key] = (time.monotonic() + self.ttl, results, model_outputs, size)
+            self._entries.move_to_end(key)
+            self._bytes += size
+            while len(self._entries) > self.size:
+                self._bytes -= self._entries.popitem(last=False)[1][3]
+
+    def memory(self):
+        return self._bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_result_cache(name, model, cache):
+    """
+    Return the result cache of the process `name` using `model`, created from its `cache` config the first time,
+    so it is shared by the processes of all the clients.
+    """
+
+    with _caches_lock:
+        key = (name, model)
+        if key not in _caches:
+            _caches[key] = ResultCache(
+                name,
+                size=cache.size or 64,
+                ttl=cache.ttl if cache.ttl is not None else 60,
+                fingerprint=cache.fingerprint or 'hash',
+                resolution=cache.resolution
+            )
+        return _caches[key]
+
+
+def caches_memory():
+    """Return the number of bytes of all the result caches."""
+
+    with _caches_lock:
+        return sum(cache.memory() for cache in _caches.values())
+
+
+def clear_caches():
+    with _caches_lock:
+        for cache in _caches.values():
+            cache.clear()
+
+
+governor.add_source('results', caches_memory, clear_caches)
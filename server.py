@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+UDP server receiving the audio of the clients and processing it in the pipe.
+
+Every packet starts with the ID of its client (`udp.id_length` bytes), followed by raw PCM data.
+The data of each client is accumulated in its own buffer, and every `rate * sample_width * channels * file_duration` bytes
+are processed in memory by the `Processing` of the client. The returned data is sent as JSON to the address of the client,
+on the port `udp.send_port`.
+
+Exemple :
+    python server.py config.yml
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import time
+
+import numpy as np
+
+from action_sink import action_sink
+from config import Config, DotDict
+from memory import governor
+from models import Processing
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def to_json(data):
+    """Serialize the returned data of a `Processing`, which can contain NumPy arrays and scalars, as JSON bytes."""
+
+    def default(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+    return json.dumps(data, default=default).encode('utf-8')
+
+
+class Client:
+    """State of a client : its buffer of audio, preallocated with the size of a chunk, and its `Processing` (created on its first chunk)."""
+
+    def __init__(self, client_id, address, chunk_size):
+        self.client_id = client_id
+        self.address = address
+        self.buffer = bytearray(chunk_size)
+        self.view = memoryview(self.buffer)
+        self.position = 0
+        self.last_seen = time.monotonic()
+        self.processing = None
+        self.pending = 0
+        # Chunks of a client are processed one at a time, in order
+        self.lock = asyncio.Lock()
+
+
+class UdpServer(asyncio.DatagramProtocol):
+    """
+    asyncio protocol receiving the packets of all the clients.
+
+    The packets are handled by the event loop, and the chunks are processed by a pool of `udp.workers` threads
+    (default : `executor.workers`, or 4), so there is no thread per client. A client can have at most `udp.max_pending`
+    chunks waiting to be processed (default : 2), the next ones are dropped.
+
+    The chunks are admitted by the memory governor (see `memory.MemoryGovernor`) as soon as they are complete, without waiting,
+    so they can be dropped while they are queued. The buffers of the clients are accounted for as the 'udp_buffers' source.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.udp = config.udp
+        self.chunk_size = int(config.audio.rate * config.audio.sample_width * config.audio.channels * config.audio.file_duration)
+        self.chunk_size -= self.chunk_size % (config.audio.sample_width * config.audio.channels)
+
+        workers = self.udp.workers or (config.executor or DotDict()).workers or 4
+        self.max_pending = self.udp.max_pending or 2
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='udp')
+
+        self.clients = {}
+        self.transport = None
+        self._expire_task = None
+
+        # Configured before the first `Processing` is created, as the chunks are admitted before
+        memory = config.memory
+        if memory is not None:
+            governor.configure(memory.budget, memory.policy, memory.max_clips)
+        governor.add_source('udp_buffers', self._buffers_memory)
+
+    def _buffers_memory(self):
+        return sum(len(client.buffer) for client in list(self.clients.values()))
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._expire_task = asyncio.get_running_loop().create_task(self._expire_clients())
+
+    def connection_lost(self, exc):
+        if self._expire_task is not None:
+            self._expire_task.cancel()
+        self.executor.shutdown(wait=False)
+
+    def datagram_received(self, packet, address):
+        if len(packet) <= self.udp.id_length:
+            return
+
+        key = packet[:self.udp.id_length]
+        client = self.clients.get(key)
+        if client is None:
+            client_id = key.decode('utf-8', errors='replace').strip('\x00 ')
+            client = self.clients[key] = Client(client_id, address, self.chunk_size)
+            logger.info("New client '%s' (%s:%d)", client_id, *address[:2])
+
+        client.address = address
+        client.last_seen = time.monotonic()
+
+        data = memoryview(packet)[self.udp.id_length:]
+        while len(data) > 0:
+            size = min(len(data), self.chunk_size - client.position)
+            client.view[client.position:client.position + size] = data[:size]
+            client.position += size
+            data = data[size:]
+
+            if client.position == self.chunk_size:
+                self._hand_over(client, bytes(client.buffer))
+                client.position = 0
+
+    def _hand_over(self, client, chunk):
+        """Schedule the processing of the full chunk of the client, unless it already has too many pending chunks."""
+
+        if client.pending >= self.max_pending:
+            logger.warning("Client '%s' : chunk dropped, %d chunks are already waiting", client.client_id, client.pending)
+            return
+
+        client.pending += 1
+        ticket = governor.admit(len(chunk), client.client_id, wait=False)
+        asyncio.get_running_loop().create_task(self._process(client, chunk, ticket))
+
+    async def _process(self, client, chunk, ticket):
+        """Process the chunk in a worker thread, and send the returned data to the client (nothing if the chunk was dropped)."""
+
+        loop = asyncio.get_running_loop()
+        try:
+            async with client.lock:
+                returned_data = await loop.run_in_executor(self.executor, self._process_chunk, client, chunk, ticket)
+        except Exception:
+            logger.exception("Client '%s' : error while processing a chunk", client.client_id)
+            return
+        finally:
+            client.pending -= 1
+            ticket.release()
+
+        if returned_data is None:
+            return
+
+        message = to_json({'id': client.client_id, 'results': returned_data})
+        self.transport.sendto(message, (client.address[0], self.udp.send_port))
+
+    def _process_chunk(self, client, chunk, ticket):
+        if client.processing is None:
+            client.processing = Processing(self.config, client.client_id, parallel=False)
+        return client.processing.process(chunk, ticket)
+
+    async def _expire_clients(self):
+        """Forget the clients which did not send anything for `udp.timeout` seconds (their partial chunk is lost)."""
+
+        while True:
+            await asyncio.sleep(max(0.1, self.udp.timeout / 2))
+            now = time.monotonic()
+            for key, client in list(self.clients.items()):
+                if now - client.last_seen > self.udp.timeout:
+                    del self.clients[key]
+                    logger.info("Client '%s' timed out", client.client_id)
+
+
+async def serve(config):
+    """Run the UDP server until it is cancelled."""
+
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: UdpServer(config),
+        local_addr=(config.udp.ip_address, config.udp.recv_port)
+    )
+    logger.info('Listening on %s:%d', config.udp.ip_address, config.udp.recv_port)
+
+    try:
+        await asyncio.Future()
+    finally:
+        transport.close()
+        action_sink.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Receive the audio of the clients over UDP and process it in the pipe.')
+    parser.add_argument('config', nargs='?', default='config.yml', help='config file (default : config.yml)')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(Config(args.config)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class StreamBuffer:
+    """
+    Ring buffer of the last `size` samples of a stream.
+
+    Its `write` method gives back the last `size` samples as a contiguous (read-only) window every `hop` new samples,
+    starting as soon as the buffer is full for the first time.
+    The samples are written twice in a buffer of length 2 * `size`, so a window never has to be copied.
+    """
+
+    def __init__(self, size, hop):
+        if hop <= 0 or hop > size:
+            raise ValueError("The hop of the stream should be between 1 and {} samples, not {}.".format(size, hop))
+
+        self.size = size
+        self.hop = hop
+        self._buffer = np.zeros(2 * size, dtype=np.float32)
+        # Number of samples written since the beginning of the stream
+        self._written = 0
+        # Number of samples to write before the next window
+        self._until_window = size
+
+    def _write(self, samples):
+        """Write at most `size` samples in the buffer."""
+
+        start = self._written % self.size
+        first = min(len(samples), self.size - start)
+        rest = len(samples) - first
+
+        self._buffer[start:start + first] = samples[:first]
+        self._buffer[start + self.size:start + self.size + first] = samples[:first]
+        self._buffer[:rest] = samples[first:]
+        self._buffer[self.size:self.size + rest] = samples[first:]
+
+        self._written += len(samples)
+
+    def window(self):
+        """Return a read-only view of the last `size` samples."""
+
+        start = self._written % self.size
+        window = self._buffer[start:start + self.size]
+        window.flags.writeable = False
+        return window
+
+    def write(self, samples):
+        """
+        Generator writing the samples in the buffer, and yielding (window, start) each time a window is complete,
+        `start` being the position of its first sample in the stream.
+
+        A window is only valid until the next iteration, as the following samples are written in the same buffer.
+        """
+
+        while len(samples) > 0:
+            count = min(len(samples), self._until_window)
+            self._write(samples[:count])
+            samples = samples[count:]
+            self._until_window -= count
+
+            if self._until_window == 0:
+                self._until_window = self.hop
+                yield (self.window(), self._written - self.size)
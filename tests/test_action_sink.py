@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+import pytest
+
+from action_sink import ActionSink
+
+
+def _write(filepath):
+    with open(filepath, 'w', encoding='utf-8') as fo:
+        fo.write('data')
+
+
+@pytest.mark.parametrize('enabled', [False, True])
+def test_deleted_directory_is_created_again(tmp_path, enabled):
+    sink = ActionSink()
+    sink.configure(enabled)
+    directory = str(tmp_path / 'saved')
+
+    sink.submit(_write, os.path.join(directory, 'a.txt'), directory=directory)
+    sink.flush()
+    shutil.rmtree(directory)
+    sink.submit(_write, os.path.join(directory, 'b.txt'), directory=directory)
+    sink.flush()
+
+    assert os.listdir(directory) == ['b.txt']
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import random
+import types
+
+import numpy as np
+import pytest
+
+from action_trigger import ActionTriggerCollection, BatchHistogram, ResultHistogram
+
+
+CLASSES = ['true', 'false', 'dog', 'cat']
+CONDITIONS = ['true>0', 'false<=34.2%', 'true>=2;false<3', 'dog==1', 'true,false', 'cat>50%;dog>0', 'true', 'n/a<1']
+
+
+def _random_results(count, seed=1):
+    rng = random.Random(seed)
+    return [[rng.choice(CLASSES) for _ in range(rng.randint(0, 5))] for _ in range(count)]
+
+
+@pytest.mark.parametrize('condition', CONDITIONS)
+def test_batch_evaluation_matches_single(condition):
+    results = _random_results(300)
+    single = ActionTriggerCollection(condition)
+    batch = ActionTriggerCollection(condition)
+
+    expected = [single.is_valid(result) for result in results]
+
+    np.testing.assert_array_equal(batch.is_valid_batch(results), expected)
+    np.testing.assert_array_equal(batch.is_valid_batch(results, BatchHistogram(results)), expected)
+    assert (batch.evaluations, batch.passes) == (2 * single.evaluations, 2 * single.passes)
+
+
+def test_shared_histogram_matches_own_histogram():
+    for result in _random_results(100):
+        histogram = ResultHistogram(result)
+        for condition in CONDITIONS:
+            assert ActionTriggerCollection(condition).is_valid(result, histogram) == ActionTriggerCollection(condition).is_valid(result)
+
+
+def test_batch_actions_match_single_actions():
+    # The pre-processing module needs librosa
+    models = pytest.importorskip('models')
+    from processes import Process
+
+    process = types.SimpleNamespace(
+        on_result_actions=[(ActionTriggerCollection(condition), 'on ' + condition) for condition in CONDITIONS],
+        on_not_result_actions=[(ActionTriggerCollection(condition), 'not ' + condition) for condition in CONDITIONS],
+        on_always_actions=['always']
+    )
+    for name in ('get_on_result_actions', 'get_on_not_result_actions', 'get_always_actions', 'evaluate_triggers_batch'):
+        setattr(process, name, types.MethodType(getattr(Process, name), process))
+    processing = models.Processing.__new__(models.Processing)
+
+    results = _random_results(300)
+    expected = [list(processing.get_actions(process, result)) for result in results]
+
+    assert processing.get_actions_batch(process, results) == expected
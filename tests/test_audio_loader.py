@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import wave
+
+import numpy as np
+import pytest
+
+from audio_loader import decode_pcm, encode_pcm, mix_channels, read_wave
+from quantization import pcm_to_float
+
+
+def _reference_samples(data, sample_width):
+    """Signed samples of the little-endian PCM data, one at a time (8-bit samples are unsigned)."""
+
+    samples = []
+    for k in range(0, len(data), sample_width):
+        if sample_width == 1:
+            samples.append(data[k] - 128)
+        else:
+            samples.append(int.from_bytes(data[k:k + sample_width], 'little', signed=True))
+    return np.array(samples, dtype=np.float64) / 2**(8 * sample_width - 1)
+
+
+@pytest.mark.parametrize('sample_width', [1, 2, 3, 4])
+def test_decode_pcm_matches_reference(sample_width):
+    data = np.random.default_rng(sample_width).integers(0, 256, 600 * sample_width, dtype=np.uint8).tobytes()
+
+    audio = decode_pcm(data, sample_width, channels=2)
+
+    assert audio.shape == (300, 2)
+    np.testing.assert_allclose(pcm_to_float(audio).reshape((-1)), _reference_samples(data, sample_width), atol=1e-7)
+
+
+@pytest.mark.parametrize('sample_width', [1, 2, 3, 4])
+def test_encode_pcm_round_trip(sample_width):
+    audio = np.array([0, 0.5, -0.5, 1, -1, 0.25, -1.5, 1.5], dtype=np.float32)
+
+    data = encode_pcm(audio, sample_width)
+
+    assert len(data) == len(audio) * sample_width
+    decoded = pcm_to_float(decode_pcm(data, sample_width)[:, 0])
+    np.testing.assert_allclose(decoded, np.clip(audio, -1, 1), atol=2 / 2**(8 * sample_width - 1))
+
+
+@pytest.mark.parametrize('sample_width', [1, 2, 3, 4])
+@pytest.mark.parametrize('mmap_threshold', [0, 1 << 20])
+def test_read_wave(tmp_path, sample_width, mmap_threshold):
+    data = np.random.default_rng(0).integers(0, 256, 400 * sample_width, dtype=np.uint8).tobytes()
+    filepath = str(tmp_path / 'audio.wav')
+    with wave.open(filepath, 'wb') as ww:
+        ww.setnchannels(2)
+        ww.setsampwidth(sample_width)
+        ww.setframerate(8000)
+        ww.writeframes(data)
+
+    audio, rate = read_wave(filepath, mmap_threshold)
+
+    assert rate == 8000 and audio.shape == (200, 2)
+    np.testing.assert_allclose(pcm_to_float(audio).reshape((-1)), _reference_samples(data, sample_width), atol=1e-7)
+
+
+@pytest.mark.parametrize('sample_width', [1, 3])
+def test_mix_channels_of_decoded_samples(sample_width):
+    data = np.random.default_rng(1).integers(0, 256, 600 * sample_width, dtype=np.uint8).tobytes()
+
+    mixed = mix_channels(decode_pcm(data, sample_width, channels=3))
+
+    np.testing.assert_allclose(mixed, _reference_samples(data, sample_width).reshape((-1, 3)).mean(axis=1), atol=1e-6)
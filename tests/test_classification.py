@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import numpy as np
+import pytest
+
+# The pre-processing module needs librosa
+processes = pytest.importorskip('processes')
+
+
+def _reference_post_process(raw_results, labels, count, minimum_confidence):
+    """Top-k selection as it was done before it was vectorized : full sort of every row."""
+
+    sorted_indexes = raw_results.argsort(1)[:, -count:]
+    sorted_results = np.sort(raw_results, 1)[:, -count:]
+
+    classes, values = [], []
+    for y, row in enumerate(sorted_indexes):
+        for x, ind in reversed(list(enumerate(row))):
+            confidence = sorted_results[y, x]
+            if confidence >= minimum_confidence and ind in labels:
+                classes.append(labels[ind])
+                values.append(confidence)
+            else:
+                classes.append('N/A')
+                values.append(0.0)
+    return [str(cls).lower() for cls in classes], values
+
+
+def _classification_process(tmp_path, count, minimum_confidence):
+    # Some indexes have no label, and the last classes are not in the file
+    labels_path = tmp_path / 'labels.csv'
+    labels_path.write_text('\n'.join('{},Class{}'.format(k, k) for k in range(40) if k % 7 != 3), encoding='utf-8')
+
+    process = processes.ClassificationProcess.__new__(processes.ClassificationProcess)
+    process._local = threading.local()
+    process.load_labels(str(labels_path))
+    process.count = count
+    process.minimum_confidence = minimum_confidence
+    return process
+
+
+@pytest.mark.parametrize('count, minimum_confidence', [(1, 0.0), (3, 0.5), (10, 0.2), (50, 0.0)])
+def test_top_k_matches_full_sort(tmp_path, count, minimum_confidence):
+    process = _classification_process(tmp_path, count, minimum_confidence)
+    raw_results = np.random.default_rng(count).random((6, 45)).astype(np.float32)
+
+    results = process._post_process(None, raw_results)
+    classes, values = _reference_post_process(raw_results, process.labels, min(count, raw_results.shape[1]), minimum_confidence)
+
+    assert results['classes'] == classes
+    np.testing.assert_array_equal(results['values'], values)
+    assert results['indices'].shape == results['confidences'].shape == (6, min(count, 45))
+    # Decreasing confidences in every row
+    assert np.all(np.diff(results['confidences'], axis=1) <= 0)
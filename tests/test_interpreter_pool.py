@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import numpy as np
+
+from interpreter_pool import ModelRegistry
+
+
+class _Interpreter:
+    """Minimal interpreter without model, with one float input and output layer."""
+
+    def __init__(self, model_path=None, **kwargs):
+        self.shape = (1,)
+
+    def get_input_details(self):
+        return [{'index': 0, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape, strict=False):
+        self.shape = tuple(shape)
+
+    def allocate_tensors(self):
+        pass
+
+
+def test_unload_idle_pools_of_the_same_model():
+    registry = ModelRegistry(max_interpreters=2, interpreter_class=_Interpreter)
+    pools = [registry.get_pool('model.tflite', shape) for shape in ((1, 100), (1, 200))]
+    assert registry.live_interpreters() == 2
+
+    time.sleep(0.01)
+    assert registry.unload_idle(0) == 2
+    assert registry.live_interpreters() == 0
+
+    # The slots are free again
+    with pools[0].checkout(), pools[1].checkout():
+        assert registry.live_interpreters() == 2
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+import yaml
+
+# The pre-processing module needs librosa
+models = pytest.importorskip('models')
+
+from benchmark import StubInterpreter, generate_clips, generate_config
+from config import Config
+from interpreter_pool import registry
+from memory import governor
+
+
+@pytest.fixture
+def stub_interpreters():
+    interpreter_class, max_interpreters = registry.interpreter_class, registry.max_interpreters
+    registry.interpreter_class = StubInterpreter
+    yield
+    registry.interpreter_class, registry.max_interpreters = interpreter_class, max_interpreters
+    governor.configure(None, 'block', None)
+
+
+def _processing(directory, memory, **sections):
+    path = generate_config(str(directory), 1)
+    with open(path, encoding='utf-8') as fi:
+        config = yaml.safe_load(fi)
+    config['memory'] = memory
+    config.update(sections)
+    config['batch'] = {'size': 4}
+    with open(path, 'w', encoding='utf-8') as fo:
+        yaml.safe_dump(config, fo)
+
+    config = Config(path)
+    StubInterpreter.classifiers = {process.model for process in config.pipeline.processes if process.type == 'classification'}
+    return models.Processing(config, 'test', parallel=False)
+
+
+@pytest.mark.parametrize('memory', [{'max_clips': 1, 'policy': 'block'}, {'budget': 1, 'policy': 'block'}])
+def test_batch_is_not_blocked_by_its_own_clips(tmp_path, stub_interpreters, memory):
+    processing = _processing(tmp_path, memory)
+    filenames = generate_clips(str(tmp_path), 4, 1)
+
+    returned_data = []
+    thread = threading.Thread(target=lambda: returned_data.extend(processing.process_batch(filenames)), daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert len(returned_data) == 4
+    assert all('anomalies' in data for data in returned_data)
+    assert governor.usage()['clips'] == {'queued': 0, 'running': 0}
+
+
+def test_config_without_memory_keeps_the_limits(tmp_path, stub_interpreters):
+    governor.configure(1 << 20, 'shed', 3)
+    _processing(tmp_path, None)
+
+    assert (governor.budget, governor.policy, governor.max_clips) == (1 << 20, 'shed', 3)
+
+
+def test_config_without_idle_timeout_keeps_it(tmp_path, stub_interpreters):
+    registry.set_idle_timeout(60)
+    try:
+        _processing(tmp_path, None, interpreters={'max_live': 8})
+        assert registry.idle_timeout == 60
+    finally:
+        registry.set_idle_timeout(None)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from quantization import TensorQuantization
+
+
+@pytest.mark.parametrize('dtype, scale', [(np.int8, 1 / 128), (np.int8, 1 / 64), (np.int8, 1 / 256), (np.uint8, 1 / 128), (np.int16, 1 / 32768)])
+def test_quantize_pcm_rounds_like_float(dtype, scale):
+    zero_point = 128 if dtype == np.uint8 else 0
+    quantization = TensorQuantization(dtype, scale, zero_point)
+
+    pcm = np.arange(-32768, 32768, dtype=np.int16)
+    # Same computation through float, as for the scales which are not a power of two
+    expected = np.rint(pcm.astype(np.float64) / 32768 / scale) + zero_point
+    expected = np.clip(expected, np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+
+    np.testing.assert_array_equal(quantization.quantize(pcm), expected)
+
+
+def test_quantize_pcm_rounds_to_nearest():
+    quantization = TensorQuantization(np.int8, 1 / 128)
+
+    np.testing.assert_array_equal(quantization.quantize(np.array([-1, 255, 128, 384, -128], dtype=np.int16)), [0, 1, 0, 2, 0])
+
+
+def test_quantize_32_bit_pcm():
+    quantization = TensorQuantization(np.int8, 1 / 128)
+    pcm = np.array([2**31 - 1, -2**31, 2**23, 3 * 2**23], dtype=np.int32)
+
+    np.testing.assert_array_equal(quantization.quantize(pcm), [127, -128, 0, 2])
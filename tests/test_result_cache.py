@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from quantization import pcm_to_float
+from result_cache import ResultCache
+
+
+@pytest.mark.parametrize('fingerprint', ResultCache.FINGERPRINTS)
+def test_integer_audio_has_the_key_of_float_audio(fingerprint):
+    cache = ResultCache('test', fingerprint=fingerprint)
+    audio = (np.random.default_rng(0).standard_normal(16000) * 0.1).astype(np.float32)
+    pcm = np.rint(audio * 32768).astype(np.int16)
+
+    assert cache.key(pcm) == cache.key(pcm_to_float(pcm))
+
+
+def test_integer_audio_within_resolution_shares_the_key():
+    cache = ResultCache('test')
+    pcm = np.full(16000, 1000, dtype=np.int16)
+
+    # One LSB is much less than the default resolution of 1/256
+    assert cache.key(pcm) == cache.key(pcm + 1)